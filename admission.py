@@ -0,0 +1,266 @@
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from tracing import incr, span
+
+# Limits of the Q&A service, configured from the environment. Only distinct
+# questions take an active slot, identical in-flight questions share one.
+max_active_requests = int(os.getenv("LOCALRAG_MAX_ACTIVE", "8"))
+max_queued_requests = int(os.getenv("LOCALRAG_MAX_QUEUED", "32"))
+queue_timeout_s = float(os.getenv("LOCALRAG_QUEUE_TIMEOUT_S", "10"))
+rate_limit_per_minute = float(os.getenv("LOCALRAG_RATE_LIMIT_PER_MINUTE", "30"))
+rate_limit_burst = int(os.getenv("LOCALRAG_RATE_LIMIT_BURST", "10"))
+
+_qa_service = None
+
+
+class RateLimited(Exception):
+    """The client sent more questions than its rate limit allows."""
+
+    def __init__(self, retry_after_s):
+        super().__init__(f"Rate limit exceeded, retry in {math.ceil(retry_after_s)}s")
+        self.retry_after_s = retry_after_s
+
+
+class Overloaded(Exception):
+    """The queue is full or the wait for a free slot timed out."""
+
+    def __init__(self, retry_after_s=1.0):
+        super().__init__("Service is overloaded, please try again shortly")
+        self.retry_after_s = retry_after_s
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip(" ?!.")
+
+
+def coalesce_key(query, settings):
+    """Requests with the same normalized query and settings share one answer."""
+    return json.dumps([normalize_query(query), settings], sort_keys=True, default=str)
+
+
+class RateLimiter:
+    """Token bucket per client: `burst` questions at once, refilled at `rate_per_minute`."""
+
+    def __init__(
+        self, rate_per_minute=rate_limit_per_minute, burst=rate_limit_burst, max_clients=10000
+    ):
+        self.rate_per_s = rate_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, client_id, cost=1):
+        """
+        Take `cost` tokens from the client's bucket, all or none.
+
+        Returns:
+            tuple: (allowed, seconds until enough tokens if not allowed)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate_per_s)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[client_id] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / self.rate_per_s
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state
+        full_after_s = self.burst / self.rate_per_s
+        for client_id, (_, updated) in list(self._buckets.items()):
+            if now - updated > full_after_s:
+                del self._buckets[client_id]
+
+
+class AdmissionController:
+    """Bound the number of active requests and of requests waiting for a slot."""
+
+    def __init__(
+        self,
+        max_active=max_active_requests,
+        max_queued=max_queued_requests,
+        timeout_s=queue_timeout_s,
+    ):
+        self.max_queued = max_queued
+        self.timeout_s = timeout_s
+        self.queued = 0
+        self._slots = threading.BoundedSemaphore(max_active)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take an active slot, raising Overloaded instead of waiting too long."""
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self.queued >= self.max_queued:
+                incr("admission_shed")
+                raise Overloaded()
+            self.queued += 1
+        try:
+            with span("queue_wait"):
+                acquired = self._slots.acquire(timeout=self.timeout_s)
+        finally:
+            with self._lock:
+                self.queued -= 1
+        if not acquired:
+            incr("admission_shed")
+            raise Overloaded()
+
+    def release(self):
+        self._slots.release()
+
+
+class _Flight:
+    """One in-flight answer, replayed to every request that joins it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """Yield all chunks from the start, then new ones as they arrive."""
+        position = 0
+        while True:
+            with self._cond:
+                while position == len(self.chunks) and not self.done:
+                    self._cond.wait()
+                chunks = self.chunks[position:]
+                finished, error = self.done, self.error
+            position += len(chunks)
+            yield from chunks
+            if finished and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+def _generate(query, **settings):
+    from generation import generate_rag_response
+
+    return generate_rag_response(query, stream=True, **settings)
+
+
+class QAService:
+    """
+    Front door of the Q&A pipeline.
+
+    Every request is checked against its client's rate limit. Identical
+    questions in flight are coalesced so one pipeline run streams to all of
+    them, and distinct questions go through admission control.
+    """
+
+    def __init__(self, generate=None, rate_limiter=None, admission=None):
+        self.generate = generate or _generate
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.admission = admission or AdmissionController()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def check_rate_limit(self, client_id, cost=1):
+        """Charge `cost` questions to the client's rate limit, raising RateLimited when over it."""
+        allowed, retry_after_s = self.rate_limiter.allow(client_id, cost)
+        if not allowed:
+            incr("admission_rate_limited")
+            raise RateLimited(retry_after_s)
+
+    def answer_stream(self, query, client_id="anonymous", rate_limit=True, **settings):
+        """
+        Start or join the answer to a question.
+
+        Args:
+            query: User query
+            client_id: Key of the rate limit, e.g. the client address
+            rate_limit: Charge the question to the client's rate limit, off
+                when the caller already charged a whole batch
+            **settings: Keyword arguments of generate_rag_response
+
+        Returns:
+            iterator: Answer chunks as streamed by generate_rag_response
+
+        Raises:
+            RateLimited: The client is over its rate limit
+            Overloaded: Too many distinct questions are queued
+        """
+        if rate_limit:
+            self.check_rate_limit(client_id)
+
+        key = coalesce_key(query, settings)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            incr("admission_coalesced")
+            return flight.subscribe()
+
+        try:
+            self.admission.acquire()
+        except Overloaded as e:
+            # Requests that joined meanwhile are shed as well
+            self._forget(key, flight)
+            flight.finish(e)
+            raise
+        # The copied context keeps the pipeline's spans in the request's trace
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run, key, flight, query, settings),
+            daemon=True,
+        ).start()
+        return flight.subscribe()
+
+    def _run(self, key, flight, query, settings):
+        # Runs apart from the request thread, so a leader that disconnects
+        # does not cut off the requests sharing its answer
+        try:
+            for chunk in self.generate(query, **settings):
+                flight.publish(chunk)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self.admission.release()
+            self._forget(key, flight)
+        flight.finish(error)
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+
+def get_qa_service():
+    """Create the shared Q&A service on first use."""
+    global _qa_service
+    if _qa_service is None:
+        _qa_service = QAService()
+    return _qa_service
@@ -0,0 +1,316 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from admission import Overloaded, RateLimited, get_qa_service
+
+# Headless JSON API next to the Gradio UI, served with the standard library:
+#   POST /search  {"query": ...} or {"queries": [...]} -> hits
+#   POST /answer  {"query": ...} or {"queries": [...]} -> answer and citations,
+#                 streamed as Server-Sent Events with {"stream": true}
+#   GET  /health
+api_host = os.getenv("LOCALRAG_API_HOST", "0.0.0.0")
+api_port = int(os.getenv("LOCALRAG_API_PORT", "8000"))
+max_batch_size = 200
+max_batch_workers = 8
+
+max_top_k = 100
+
+SEARCH_TYPES = ("keyword", "semantic", "hybrid")
+FILTER_KEYS = ("content_types", "filenames", "page_range", "fiscal_year")
+ANSWER_SETTINGS = (
+    "search_type", "top_k", "model_type", "rerank", "filters", "expand", "use_tables",
+    "table_fast_path",
+)
+
+
+class BadRequest(Exception):
+    """The request body is not valid for the endpoint."""
+
+
+def _top_k(body, default):
+    top_k = body.get("top_k", default)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= max_top_k:
+        raise BadRequest(f"'top_k' must be an integer from 1 to {max_top_k}")
+    return top_k
+
+
+def _filters(body):
+    filters = body.get("filters")
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise BadRequest("'filters' must be an object")
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise BadRequest(f"Unknown filters {', '.join(sorted(unknown))}")
+    for key in ("content_types", "filenames"):
+        values = filters.get(key)
+        if values is not None and (
+            not isinstance(values, list) or not all(isinstance(v, str) for v in values)
+        ):
+            raise BadRequest(f"'filters.{key}' must be a list of strings")
+    page_range = filters.get("page_range")
+    if page_range is not None:
+        if not isinstance(page_range, list) or len(page_range) != 2 or not all(
+            p is None or (isinstance(p, int) and not isinstance(p, bool)) for p in page_range
+        ):
+            raise BadRequest("'filters.page_range' must be [first, last] pages or null")
+        filters = {**filters, "page_range": tuple(page_range)}
+    fiscal_year = filters.get("fiscal_year")
+    if fiscal_year is not None:
+        years = fiscal_year if isinstance(fiscal_year, list) else [fiscal_year]
+        if not all(isinstance(y, int) and not isinstance(y, bool) for y in years):
+            raise BadRequest("'filters.fiscal_year' must be a year or a list of years")
+    return filters
+
+
+def _queries(body):
+    if "queries" in body:
+        queries = body["queries"]
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            raise BadRequest("'queries' must be a list of strings")
+        if len(queries) > max_batch_size:
+            raise BadRequest(f"At most {max_batch_size} queries per request")
+        return queries
+    if not isinstance(body.get("query"), str) or not body["query"].strip():
+        raise BadRequest("'query' is required")
+    return None
+
+
+def _check_batch_rate_limit(service, client_id, size):
+    """Charge every question of a request to the client's rate limit before any work."""
+    if size > service.rate_limiter.burst:
+        raise BadRequest(
+            f"At most {service.rate_limiter.burst} queries per request under the rate limit"
+        )
+    service.check_rate_limit(client_id, cost=size)
+
+
+def handle_search(body, client_id="anonymous"):
+    """
+    Run one search, or a batch of searches with a single _msearch.
+
+    Searches share the rate limit and the active slots of the Q&A service,
+    a batch costs one token per query.
+
+    Args:
+        body: {"query" | "queries", "search_type", "top_k", "filters",
+            "source_fields", "highlight"}
+        client_id: Key of the rate limit
+
+    Returns:
+        dict: {"hits": [...]} or {"results": [[...], ...]} for a batch
+    """
+    import retrieval
+
+    search_type = body.get("search_type", "hybrid")
+    if search_type not in SEARCH_TYPES:
+        raise BadRequest(f"'search_type' must be one of {', '.join(SEARCH_TYPES)}")
+    top_k = _top_k(body, 10)
+    filters = _filters(body)
+    source_fields = body.get("source_fields")
+
+    queries = _queries(body)
+    service = get_qa_service()
+    _check_batch_rate_limit(service, client_id, len(queries) if queries is not None else 1)
+
+    service.admission.acquire()
+    try:
+        if queries is not None:
+            return {
+                "results": retrieval.batch_search(
+                    queries, search_type, top_k, filters=filters, source_fields=source_fields
+                )
+            }
+
+        kwargs = {"top_k": top_k, "filters": filters, "source_fields": source_fields}
+        if search_type != "semantic":
+            kwargs["highlight"] = bool(body.get("highlight", False))
+        search = getattr(retrieval, f"{search_type}_search")
+        return {"hits": search(body["query"], **kwargs)}
+    finally:
+        service.admission.release()
+
+
+def _answer_settings(body):
+    settings = {key: body[key] for key in ANSWER_SETTINGS if key in body}
+    if "top_k" in body:
+        settings["top_k"] = _top_k(body, 5)
+    for key in ("rerank", "use_tables", "table_fast_path"):
+        if key in settings and not isinstance(settings[key], bool):
+            raise BadRequest(f"'{key}' must be true or false")
+    settings["filters"] = _filters(body)
+    settings["citations"] = True
+    return settings
+
+
+def collect_answer(chunks):
+    """Join streamed chunks into {"answer": ..., "citations": [...]}."""
+    answer, citations = [], []
+    for chunk in chunks:
+        if isinstance(chunk, dict):
+            citations = chunk["citations"]
+        else:
+            answer.append(chunk)
+    return {"answer": "".join(answer), "citations": citations}
+
+
+def handle_answer_batch(queries, settings, client_id):
+    """
+    Answer several questions concurrently, each through the Q&A service.
+
+    Every question is charged to the client's rate limit up front, so the
+    batch is either refused as a whole (RateLimited) or runs completely.
+    Items shed by admission control are returned with an "error".
+    """
+    service = get_qa_service()
+    _check_batch_rate_limit(service, client_id, len(queries))
+
+    def answer(query):
+        try:
+            return collect_answer(
+                service.answer_stream(query, client_id, rate_limit=False, **settings)
+            )
+        except Overloaded as e:
+            return {"error": str(e), "retry_after_s": e.retry_after_s}
+
+    with ThreadPoolExecutor(max_workers=min(max_batch_workers, len(queries) or 1)) as executor:
+        return {"results": list(executor.map(answer, queries))}
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _client_id(self):
+        # Rate limits are per peer address, headers are set by the client
+        return self.client_address[0]
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, retry_after_s=None):
+        headers = {"Retry-After": str(max(1, round(retry_after_s)))} if retry_after_s else None
+        self._send_json(status, {"error": message}, headers)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            raise BadRequest("Request body must be JSON")
+        if not isinstance(body, dict):
+            raise BadRequest("Request body must be a JSON object")
+        return body
+
+    def _write_chunk(self, data):
+        # Chunked transfer encoding lets the connection outlive the stream
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_event(self, event, payload):
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        self._write_chunk(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+
+    def _stream_answer(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, dict):
+                    self._send_event("citations", chunk["citations"])
+                else:
+                    self._send_event("token", {"text": chunk})
+            self._send_event("done", {})
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away, coalesced requests keep their answer
+            self.close_connection = True
+            return
+        except Exception as e:
+            self._send_event("error", {"error": str(e)})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_error(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+            if self.path == "/search":
+                self._send_json(200, handle_search(body, self._client_id()))
+            elif self.path == "/answer":
+                self._handle_answer(body)
+            else:
+                self._send_error(404, f"Unknown path {self.path}")
+        except BadRequest as e:
+            self._send_error(400, str(e))
+        except RateLimited as e:
+            self._send_error(429, str(e), e.retry_after_s)
+        except Overloaded as e:
+            self._send_error(503, str(e), e.retry_after_s)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception as e:
+            print(f"API error on {self.path}: {e}")
+            self._send_error(500, str(e))
+
+    def _handle_answer(self, body):
+        settings = _answer_settings(body)
+        queries = _queries(body)
+        if queries is not None:
+            if body.get("stream"):
+                raise BadRequest("Batch answers cannot be streamed")
+            self._send_json(200, handle_answer_batch(queries, settings, self._client_id()))
+            return
+
+        chunks = get_qa_service().answer_stream(body["query"], self._client_id(), **settings)
+        if body.get("stream"):
+            self._stream_answer(chunks)
+        else:
+            self._send_json(200, collect_answer(chunks))
+
+
+def serve(host=api_host, port=api_port):
+    """Serve the API until interrupted."""
+    from tracing import serve_metrics
+
+    serve_metrics()
+    server = ThreadingHTTPServer((host, port), APIRequestHandler)
+    server.daemon_threads = True
+    print(f"[INFO] Serving LocalRAG API on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Headless LocalRAG HTTP API")
+    arg_parser.add_argument("--host", default=api_host)
+    arg_parser.add_argument("--port", type=int, default=api_port)
+    args = arg_parser.parse_args()
+
+    serve(args.host, args.port)
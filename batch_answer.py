@@ -0,0 +1,137 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from generation import build_rag_prompt, generate_text
+from retrieval import batch_search
+from table_store import answer_from_tables
+
+json_output_batch_answers_path = "batch_answers.jsonl"
+
+
+def load_questions(path: str):
+    """
+    Load questions from a text file (one per line) or a JSONL file with a
+    "question" field per line.
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                questions.append(json.loads(line)["question"])
+            else:
+                questions.append(line)
+    return questions
+
+
+def batch_answer(
+    questions,
+    search_type="hybrid",
+    top_k=5,
+    model_type="auto",
+    max_workers=4,
+    output_path=json_output_batch_answers_path,
+    use_tables=True,
+    table_fast_path=False,
+):
+    """
+    Answer many questions offline and write the results as JSONL.
+
+    All questions are embedded and searched in batched requests, then
+    answers are generated with at most `max_workers` concurrent LLM calls.
+
+    Args:
+        questions: List of question strings
+        search_type: Type of search (keyword, semantic, hybrid)
+        top_k: Number of chunks per prompt
+        model_type: "auto", a provider (gemini, ollama) or a backend name
+        max_workers: Maximum number of concurrent generation calls
+        output_path: JSONL file receiving one record per question
+        use_tables: Ground numeric questions with facts from the table store
+        table_fast_path: Answer numeric questions about a named year from
+            the table store without an LLM call when exactly one row matches
+
+    Returns:
+        list: Records in input order
+    """
+    started = time.perf_counter()
+
+    print(f"[INFO] Retrieving context for {len(questions)} questions...")
+    all_results = batch_search(questions, search_type=search_type, top_k=top_k)
+    retrieval_seconds = time.perf_counter() - started
+
+    def answer(index):
+        question, results = questions[index], all_results[index]
+        direct_answer, table_facts = None, []
+        if use_tables:
+            direct_answer, table_facts = answer_from_tables(question)
+        if direct_answer and table_fast_path:
+            text = direct_answer
+        elif not results and not table_facts:
+            text = "No relevant information found."
+        else:
+            try:
+                text = generate_text(
+                    build_rag_prompt(question, results, table_facts), model_type, question
+                )
+            except Exception as e:
+                text = f"Error in RAG process: {str(e)}"
+        return {
+            "index": index,
+            "question": question,
+            "answer": text,
+            "sources": [hit.get("_id") for hit in results],
+        }
+
+    records = [None] * len(questions)
+    with open(output_path, "w", encoding="utf-8") as f:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(answer, i) for i in range(len(questions))]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                record = future.result()
+                records[record["index"]] = record
+                # Write as answers arrive so partial runs are not lost
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"[INFO] Retrieval took {retrieval_seconds:.2f}s")
+    print(
+        f"[INFO] Answered {len(questions)} questions in {elapsed:.2f}s "
+        f"({len(questions) / elapsed * 60:.1f} questions/minute)"
+    )
+    print(f"[INFO] Answers saved to '{output_path}'.")
+    return records
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Answer a file of questions offline")
+    arg_parser.add_argument("questions", help="Text file (one question per line) or JSONL")
+    arg_parser.add_argument("--output", default=json_output_batch_answers_path)
+    arg_parser.add_argument("--search-type", default="hybrid", choices=["keyword", "semantic", "hybrid"])
+    arg_parser.add_argument("--top-k", type=int, default=5)
+    arg_parser.add_argument("--model-type", default="auto")
+    arg_parser.add_argument("--max-workers", type=int, default=4)
+    arg_parser.add_argument("--no-tables", action="store_true", help="Do not use table facts")
+    arg_parser.add_argument(
+        "--table-fast-path", action="store_true", help="Answer clear numeric questions from tables"
+    )
+    args = arg_parser.parse_args()
+
+    batch_answer(
+        load_questions(args.questions),
+        search_type=args.search_type,
+        top_k=args.top_k,
+        model_type=args.model_type,
+        max_workers=args.max_workers,
+        output_path=args.output,
+        use_tables=not args.no_tables,
+        table_fast_path=args.table_fast_path,
+    )
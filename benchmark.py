@@ -0,0 +1,547 @@
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from unittest import mock
+
+from helper import percentile
+
+json_output_text_chunks_path = "text_chunks.json"
+json_output_image_chunks_path = "image_chunks.json"
+json_output_table_chunks_path = "table_chunks.json"
+benchmark_results_path = "benchmark_results"
+
+# Fixed question set. A retrieved chunk counts as relevant when its content
+# matches one of the patterns, so the same labels work for the local
+# stand-in and for a live index with generated document ids.
+BENCHMARK_QUESTIONS = [
+    {"question": "What was Accenture's free cash flow in fiscal 2023?", "relevant": [r"free cash flow"]},
+    {"question": "How many people does Accenture employ?", "relevant": [r"733,000"]},
+    {"question": "Who is the chair and chief executive officer of Accenture?", "relevant": [r"Julie Sweet"]},
+    {"question": "How much is Accenture investing in data and AI?", "relevant": [r"\$3 billion"]},
+    {"question": "What were Accenture's total revenues for fiscal 2023?", "relevant": [r"\$64\.1 billion"]},
+    {"question": "What were the new bookings in fiscal 2023?", "relevant": [r"\$72\.2 billion"]},
+    {"question": "What were diluted earnings per share?", "relevant": [r"\$11\.67"]},
+    {"question": "What was the operating cash flow?", "relevant": [r"operating cash flow"]},
+    {"question": "What is the net income of Accenture?", "relevant": [r"net income"]},
+    {"question": "How much was returned to shareholders through share repurchases?", "relevant": [r"share repurchase"]},
+    {"question": "What are Accenture's goals for carbon emissions?", "relevant": [r"carbon"]},
+    {"question": "Where is Accenture incorporated?", "relevant": [r"Ireland"]},
+]
+
+SEARCH_TYPES = ["keyword", "semantic", "hybrid"]
+
+# Entry points whose cold import time matters for autoscaled replicas
+IMPORT_TIME_MODULES = ["retrieval", "generation", "frontend", "api"]
+
+
+def _tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def standin_embedding(prompt, model="nomic-embed-text", dimension=256):
+    """
+    Deterministic stand-in for the Ollama embedding endpoint.
+
+    Hashes unigrams and bigrams into a fixed number of signed buckets and
+    L2-normalizes the result, so similar texts get similar vectors.
+    """
+    vector = [0.0] * dimension
+    tokens = _tokenize(prompt)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    for feature in features:
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimension
+        vector[bucket] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def standin_embeddings(prompts, model="nomic-embed-text"):
+    """Batched variant of standin_embedding."""
+    return [standin_embedding(p, model) for p in prompts]
+
+
+def standin_generate(
+    prompt_text, model_name=None, stream=False, raise_errors=False, ttft_ms=150, token_ms=5
+):
+    """
+    Deterministic stand-in for the Gemini and Ollama generation endpoints.
+
+    Waits `ttft_ms` before the first token and `token_ms` between tokens,
+    then streams back the first words of the retrieved context.
+    """
+    time.sleep(ttft_ms / 1000)
+    words = prompt_text.split()[:60]
+    for i, word in enumerate(words):
+        if i:
+            time.sleep(token_ms / 1000)
+        yield word + " "
+
+
+def load_benchmark_corpus():
+    """Load the cached chunks as (id, source) pairs like ingestion would index them."""
+    from helper import load_chunks_from_cache_file
+
+    corpus = []
+    for kind, path in [
+        ("text", json_output_text_chunks_path),
+        ("table", json_output_table_chunks_path),
+        ("image", json_output_image_chunks_path),
+    ]:
+        for i, chunk in enumerate(load_chunks_from_cache_file(path)):
+            if not chunk.get("content"):
+                continue
+            corpus.append(
+                (
+                    f"{kind}-{i}",
+                    {
+                        "content": chunk["content"],
+                        "content_type": kind,
+                        "page_number": int(chunk["page_number"]) if chunk.get("page_number") else None,
+                        "fiscal_year": 2023,
+                        "metadata": {
+                            "filename": chunk.get("filename", chunk.get("file_name", "")),
+                            "caption": chunk.get("caption", ""),
+                        },
+                    },
+                )
+            )
+    return corpus
+
+
+class StandInOpenSearch:
+    """
+    In-memory stand-in for the subset of the OpenSearch client used by
+    retrieval.py: match (BM25), knn (cosine, optionally filtered), the k-NN
+    scoring script, bool queries, term/terms/range filters, highlighting
+    and _msearch.
+    """
+
+    def __init__(self, corpus):
+        self.ids = [doc_id for doc_id, _ in corpus]
+        self.sources = [source for _, source in corpus]
+        self.vectors = [standin_embedding(s["content"]) for s in self.sources]
+        self.tokens = [Counter(_tokenize(s["content"])) for s in self.sources]
+        self.lengths = [sum(t.values()) for t in self.tokens]
+        self.avg_length = sum(self.lengths) / len(self.lengths)
+        self.document_frequency = Counter(
+            term for tokens in self.tokens for term in tokens
+        )
+
+    def ping(self):
+        return True
+
+    def info(self):
+        return {"cluster_name": "standin", "version": {"number": "standin"}}
+
+    def _match_scores(self, text):
+        scores = {}
+        n = len(self.sources)
+        for term in set(_tokenize(text)):
+            df = self.document_frequency.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i, tokens in enumerate(self.tokens):
+                tf = tokens.get(term)
+                if tf:
+                    norm = tf + 1.2 * (0.25 + 0.75 * self.lengths[i] / self.avg_length)
+                    scores[i] = scores.get(i, 0.0) + idf * tf * 2.2 / norm
+        return scores
+
+    def _field(self, i, field):
+        value = self.sources[i]
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def _matches(self, i, clause):
+        if "term" in clause:
+            (field, value), = clause["term"].items()
+            return self._field(i, field) == value
+        if "terms" in clause:
+            (field, values), = clause["terms"].items()
+            return self._field(i, field) in values
+        if "range" in clause:
+            (field, bounds), = clause["range"].items()
+            value = self._field(i, field)
+            if value is None:
+                return False
+            return value >= bounds.get("gte", value) and value <= bounds.get("lte", value)
+        if "bool" in clause:
+            return all(self._matches(i, c) for c in clause["bool"].get("filter", []))
+        raise ValueError(f"Unsupported stand-in filter: {list(clause)}")
+
+    def _filtered(self, clauses):
+        return [
+            i for i in range(len(self.sources))
+            if all(self._matches(i, clause) for clause in clauses)
+        ]
+
+    def _knn_scores(self, vector, k, candidates=None):
+        # Cosine similarity mapped to the OpenSearch cosinesimil score range
+        candidates = range(len(self.vectors)) if candidates is None else candidates
+        scored = [
+            ((1 + sum(a * b for a, b in zip(vector, self.vectors[i]))) / 2, i)
+            for i in candidates
+        ]
+        scored.sort(reverse=True)
+        return {i: score for score, i in scored[:k]}
+
+    def _scores(self, query):
+        if "match" in query:
+            return self._match_scores(query["match"]["content"])
+        if "knn" in query:
+            # Every embedding model field is served from the same stand-in vectors
+            (knn,) = query["knn"].values()
+            candidates = self._filtered([knn["filter"]]) if "filter" in knn else None
+            return self._knn_scores(knn["vector"], knn["k"], candidates)
+        if "script_score" in query:
+            candidates = self._filtered([query["script_score"]["query"]])
+            params = query["script_score"]["script"]["params"]
+            return self._knn_scores(params["query_value"], len(candidates), candidates)
+        if "bool" in query:
+            scores = {}
+            for clause in query["bool"].get("must", []):
+                scores.update(self._scores(clause))
+            for clause in query["bool"].get("should", []):
+                for i, score in self._scores(clause).items():
+                    scores[i] = scores.get(i, 0.0) + score
+            allowed = set(self._filtered(query["bool"].get("filter", [])))
+            return {i: score for i, score in scores.items() if i in allowed}
+        raise ValueError(f"Unsupported stand-in query: {list(query)}")
+
+    def _project(self, source, fields):
+        if fields is False:
+            return {}
+        if not fields:
+            return dict(source)
+        projected = {}
+        for field in fields:
+            value, target, parts = source, projected, field.split(".")
+            for part in parts[:-1]:
+                value = value.get(part, {})
+                target = target.setdefault(part, {})
+            if parts[-1] in value:
+                target[parts[-1]] = value[parts[-1]]
+        return projected
+
+    def _match_texts(self, query):
+        if "match" in query:
+            return [query["match"]["content"]]
+        if "bool" in query:
+            clauses = query["bool"].get("must", []) + query["bool"].get("should", [])
+            return [text for clause in clauses for text in self._match_texts(clause)]
+        return []
+
+    def _highlight(self, i, terms, settings):
+        # Fixed-size fragments containing a query term, best first
+        field = settings["fields"]["content"]
+        size = field.get("fragment_size", 100)
+        pre, post = settings.get("pre_tags", ["<em>"])[0], settings.get("post_tags", ["</em>"])[0]
+        content = self.sources[i]["content"]
+        fragments = []
+        for start in range(0, len(content), size):
+            fragment = content[start : start + size]
+            words = re.split(r"(\w+)", fragment)
+            found = sum(1 for word in words if word.lower() in terms)
+            if found:
+                marked = "".join(
+                    f"{pre}{word}{post}" if word.lower() in terms else word for word in words
+                )
+                fragments.append((found, start, marked))
+        fragments.sort(key=lambda f: (-f[0], f[1]))
+        return [marked for _, _, marked in fragments[: field.get("number_of_fragments", 5)]]
+
+    def search(self, index=None, body=None):
+        scores = self._scores(body["query"])
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        hits = [
+            {
+                "_index": index,
+                "_id": self.ids[i],
+                "_score": score,
+                "_source": self._project(self.sources[i], body.get("_source")),
+            }
+            for i, score in ranked[: body.get("size", 10)]
+        ]
+        if "highlight" in body:
+            terms = {t for text in self._match_texts(body["query"]) for t in _tokenize(text)}
+            for hit in hits:
+                fragments = self._highlight(self.ids.index(hit["_id"]), terms, body["highlight"])
+                if fragments:
+                    hit["highlight"] = {"content": fragments}
+        return {"hits": {"total": {"value": len(scores)}, "hits": hits}}
+
+    def mget(self, index=None, body=None, _source=None):
+        positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        docs = []
+        for doc_id in body["ids"]:
+            if doc_id in positions:
+                source = self._project(self.sources[positions[doc_id]], _source)
+                docs.append({"_index": index, "_id": doc_id, "found": True, "_source": source})
+            else:
+                docs.append({"_index": index, "_id": doc_id, "found": False})
+        return {"docs": docs}
+
+    def msearch(self, body=None, index=None):
+        responses = []
+        for header, query_body in zip(body[::2], body[1::2]):
+            responses.append(self.search(index=header.get("index", index), body=query_body))
+        return {"responses": responses}
+
+
+def standin_stack(client):
+    """
+    Patch retrieval to use the local stand-ins.
+
+    Returns:
+        ExitStack: Context manager undoing the patches
+    """
+    import retrieval
+
+    stack = ExitStack()
+    stack.enter_context(mock.patch.object(retrieval, "get_opensearch_client", lambda host, port: client))
+    stack.enter_context(mock.patch.object(retrieval, "get_embedding", standin_embedding))
+    stack.enter_context(mock.patch.object(retrieval, "get_embeddings", standin_embeddings))
+    return stack
+
+
+def standin_generation_stack():
+    """
+    Patch generation to use the stand-in backends.
+
+    generation is only imported here, for the end-to-end benchmark, so the
+    search benchmark runs without the generation dependencies.
+
+    Returns:
+        ExitStack: Context manager undoing the patches
+    """
+    import generation
+
+    stack = ExitStack()
+    stack.enter_context(mock.patch.object(generation, "generate_with_gemini", standin_generate))
+    stack.enter_context(mock.patch.object(generation, "generate_with_ollama", standin_generate))
+    # A fresh pool that considers every stand-in backend healthy
+    stack.enter_context(mock.patch.object(generation, "check_backend_health", lambda backend: True))
+    stack.enter_context(mock.patch.object(generation, "_backend_pool", None))
+    return stack
+
+
+def is_relevant(content, patterns):
+    return any(re.search(pattern, content, re.IGNORECASE) for pattern in patterns)
+
+
+def benchmark_search(search_type, corpus, k=10, repeats=3):
+    """
+    Measure recall@k, MRR and latency of one search type over the question set.
+
+    Returns:
+        tuple: (summary dict, list of per-query records)
+    """
+    import retrieval
+
+    search = {
+        "keyword": retrieval.keyword_search,
+        "semantic": retrieval.semantic_search,
+        "hybrid": retrieval.hybrid_search,
+    }[search_type]
+
+    latencies, recalls, reciprocal_ranks, payloads, records = [], [], [], [], []
+    started = time.perf_counter()
+    for item in BENCHMARK_QUESTIONS:
+        total_relevant = sum(
+            1 for _, source in corpus if is_relevant(source["content"], item["relevant"])
+        )
+        for _ in range(repeats):
+            query_started = time.perf_counter()
+            hits = search(item["question"], top_k=k)
+            latencies.append((time.perf_counter() - query_started) * 1000)
+        payloads.append(len(json.dumps(hits)))
+
+        flags = [is_relevant(hit["_source"].get("content", ""), item["relevant"]) for hit in hits]
+        recall = sum(flags) / min(total_relevant, k) if total_relevant else 0.0
+        first = next((rank for rank, flag in enumerate(flags, 1) if flag), None)
+        recalls.append(recall)
+        reciprocal_ranks.append(1 / first if first else 0.0)
+        records.append(
+            {
+                "search_type": search_type,
+                "question": item["question"],
+                f"recall@{k}": recall,
+                "first_relevant_rank": first,
+                "hit_ids": [hit["_id"] for hit in hits],
+            }
+        )
+    elapsed = time.perf_counter() - started
+
+    summary = {
+        f"recall@{k}": sum(recalls) / len(recalls),
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks),
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p95": percentile(latencies, 95),
+        "latency_ms_p99": percentile(latencies, 99),
+        "throughput_qps": len(latencies) / elapsed,
+        "payload_bytes_mean": sum(payloads) / len(payloads),
+    }
+    return summary, records
+
+
+def benchmark_end_to_end(search_type="hybrid", top_k=5, model_type="auto"):
+    """Measure time-to-first-token and total time of streamed RAG answers."""
+    from generation import generate_rag_response
+
+    ttfts, totals = [], []
+    for item in BENCHMARK_QUESTIONS:
+        started = time.perf_counter()
+        first = None
+        for chunk in generate_rag_response(item["question"], search_type, top_k, model_type, stream=True):
+            if first is None and chunk:
+                first = time.perf_counter() - started
+        totals.append((time.perf_counter() - started) * 1000)
+        ttfts.append((first if first is not None else totals[-1] / 1000) * 1000)
+
+    return {
+        "search_type": search_type,
+        "ttft_ms_p50": percentile(ttfts, 50),
+        "ttft_ms_p95": percentile(ttfts, 95),
+        "ttft_ms_p99": percentile(ttfts, 99),
+        "total_ms_p50": percentile(totals, 50),
+        "total_ms_p95": percentile(totals, 95),
+    }
+
+
+def run_benchmark(live=False, k=10, repeats=3, output_dir=benchmark_results_path):
+    """
+    Run the full benchmark and write summary.json and queries.jsonl.
+
+    Args:
+        live: Use the real OpenSearch/Ollama/Gemini stack instead of stand-ins
+        k: Cut-off for recall@k and MRR
+        repeats: Number of timed runs per question
+        output_dir: Directory receiving the result files
+
+    Returns:
+        dict: Summary of all measurements
+    """
+    corpus = load_benchmark_corpus()
+    summary = {"mode": "live" if live else "standin", "k": k, "search": {}}
+    all_records = []
+
+    with ExitStack() as stack:
+        if not live:
+            print("[INFO] Building stand-in index...")
+            stack.enter_context(standin_stack(StandInOpenSearch(corpus)))
+
+        for search_type in SEARCH_TYPES:
+            print(f"[INFO] Benchmarking {search_type} search...")
+            summary["search"][search_type], records = benchmark_search(search_type, corpus, k, repeats)
+            all_records.extend(records)
+
+        print("[INFO] Benchmarking end-to-end generation...")
+        if not live:
+            stack.enter_context(standin_generation_stack())
+        summary["end_to_end"] = benchmark_end_to_end()
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(output_dir, "queries.jsonl"), "w", encoding="utf-8") as f:
+        for record in all_records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"[INFO] Benchmark results saved to '{output_dir}'.")
+    return summary
+
+
+def measure_import_times(modules=IMPORT_TIME_MODULES, runs=3):
+    """
+    Measure cold import time of each module in a fresh interpreter.
+
+    Uses `python -X importtime` and reports the best of `runs` cumulative
+    import times, which excludes interpreter start-up.
+
+    Returns:
+        dict: Module name -> import time in milliseconds
+    """
+    import subprocess
+    import sys
+
+    results = {}
+    for module in modules:
+        timings = []
+        for _ in range(runs):
+            completed = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                print(f"[WARN] Importing {module} failed: {completed.stderr.strip().splitlines()[-1]}")
+                break
+            for line in completed.stderr.splitlines():
+                parts = [part.strip() for part in line.split("|")]
+                if len(parts) == 3 and parts[2] == module:
+                    timings.append(int(parts[1]) / 1000)
+        if timings:
+            results[module] = min(timings)
+            print(f"[INFO] import {module}: {results[module]:.1f}ms")
+    return results
+
+
+def compare_to_baseline(summary, baseline, max_recall_drop=0.02, max_latency_increase=0.2):
+    """
+    Compare a summary against a baseline summary.
+
+    Returns:
+        list: Human readable regressions, empty if none
+    """
+    regressions = []
+    k = summary["k"]
+    for search_type, current in summary["search"].items():
+        previous = baseline.get("search", {}).get(search_type)
+        if not previous:
+            continue
+        for metric in [f"recall@{k}", "mrr"]:
+            if current[metric] < previous[metric] - max_recall_drop:
+                regressions.append(
+                    f"{search_type} {metric}: {previous[metric]:.3f} -> {current[metric]:.3f}"
+                )
+        if current["latency_ms_p95"] > previous["latency_ms_p95"] * (1 + max_latency_increase):
+            regressions.append(
+                f"{search_type} p95 latency: {previous['latency_ms_p95']:.1f}ms "
+                f"-> {current['latency_ms_p95']:.1f}ms"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    arg_parser = argparse.ArgumentParser(description="Retrieval quality and latency benchmark")
+    arg_parser.add_argument("--live", action="store_true", help="Benchmark the real stack")
+    arg_parser.add_argument("--k", type=int, default=10)
+    arg_parser.add_argument("--repeats", type=int, default=3)
+    arg_parser.add_argument("--output-dir", default=benchmark_results_path)
+    arg_parser.add_argument("--baseline", help="Previous summary.json to compare against")
+    arg_parser.add_argument("--import-times", action="store_true", help="Also measure cold import times")
+    args = arg_parser.parse_args()
+
+    summary = run_benchmark(args.live, args.k, args.repeats, args.output_dir)
+    if args.import_times:
+        summary["import_ms"] = measure_import_times()
+        with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(summary, json.load(f))
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        sys.exit(1 if regressions else 0)
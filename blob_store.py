@@ -0,0 +1,86 @@
+import base64
+import hashlib
+import os
+
+# Content-addressed store for image bytes. Each blob lives at
+# <root>/<first two hex chars>/<sha256 hex digest>, so identical images are
+# stored once and documents only need to carry the digest.
+blob_store_path = "blobs"
+
+
+def _blob_path(digest, root):
+    return os.path.join(root, digest[:2], digest)
+
+
+def put_blob(data: bytes, root: str = blob_store_path):
+    """
+    Store bytes in the blob store if they are not already present.
+
+    Args:
+        data: Raw bytes to store
+        root: Blob store directory
+
+    Returns:
+        str: SHA-256 hex digest referencing the blob
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest, root)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial blobs
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def get_blob(digest: str, root: str = blob_store_path):
+    """Return the bytes stored under a digest."""
+    path = _blob_path(digest, root)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Blob {digest} not found in '{root}'")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def put_base64_image(image_base64: str, root: str = blob_store_path):
+    """Decode a base64 image and store it, returning its digest."""
+    return put_blob(base64.b64decode(image_base64), root)
+
+
+def get_base64_image(digest: str, root: str = blob_store_path):
+    """Load an image from the blob store as a base64 string for display."""
+    return base64.b64encode(get_blob(digest, root)).decode("ascii")
+
+
+def move_images_to_blob_store(chunks, root: str = blob_store_path):
+    """
+    Replace inline `image_base64` fields with `image_ref` digests.
+
+    Args:
+        chunks: Processed image chunks as stored in image_chunks.json
+        root: Blob store directory
+
+    Returns:
+        list: Chunks that only reference their image
+    """
+    migrated = []
+    for chunk in chunks:
+        chunk = dict(chunk)
+        image_base64 = chunk.pop("image_base64", None)
+        if image_base64:
+            chunk["image_ref"] = put_base64_image(image_base64, root)
+        migrated.append(chunk)
+    return migrated
+
+
+if __name__ == "__main__":
+    from helper import load_chunks_from_cache_file
+    from chunking import json_output_image_chunks_path, save_processed_chunks_to_file
+
+    # Migrate an existing image cache file to blob references
+    image_chunks = load_chunks_from_cache_file(json_output_image_chunks_path)
+    migrated_chunks = move_images_to_blob_store(image_chunks)
+    save_processed_chunks_to_file(migrated_chunks, json_output_image_chunks_path)
+    print(f"[INFO] Moved {len(migrated_chunks)} images to '{blob_store_path}'.")
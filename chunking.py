@@ -1,13 +1,16 @@
-from google import genai
-from google.genai import types
 import base64
+import json
+import requests
 from dotenv import load_dotenv
+from tqdm import tqdm
 from unstructured.documents.elements import Table, Image, FigureCaption, CompositeElement
-from parser import *
+from blob_store import put_blob
+from helper import get_gemini_client
+from tracing import span
 
 load_dotenv()
-# The client gets the API key from the environment variable `GEMINI_API_KEY`.
-client = genai.Client()
+
+encountered_errors = []
 
 json_output_text_chunks_path = "text_chunks.json"
 json_output_image_chunks_path = "image_chunks.json"
@@ -21,31 +24,35 @@ def process_image_chunks(chunks):
       else:
         caption = "No Caption"
       if isinstance(ele,Image):
+        image_bytes = base64.b64decode(ele.metadata.image_base64)
         image_data = {
             "caption":caption,
             "content":ele.text if ele.text else "" ,
             "page_number":ele.metadata.page_number,
-            "image_base64":ele.metadata.image_base64,
+            # Image bytes live in the blob store, chunks only keep the digest
+            "image_ref":put_blob(image_bytes),
             "content_type":"image/jpeg",
             "file_name":ele.metadata.filename
         }
-        image_bytes = base64.b64decode(image_data["image_base64"])
         prompt = (
             f"Analyze the following image and provide a detailed description. "
             f"Caption: '{image_data['caption']}'. "
             f"Content: '{image_data['content']}'. "
             f"Please focus on the visual elements and context of the image, delivering a thorough and insightful description without any additional commentary."
         )
-        response = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=[
-                  types.Part.from_bytes(
-                    data=image_bytes,
-                    mime_type='image/jpeg',
-                  ),
-                  prompt
-                ]
-              )
+        from google.genai import types
+
+        with span("describe", content_type="image"):
+          response = get_gemini_client().models.generate_content(
+                  model='gemini-2.5-flash',
+                  contents=[
+                    types.Part.from_bytes(
+                      data=image_bytes,
+                      mime_type='image/jpeg',
+                    ),
+                    prompt
+                  ]
+                )
         image_data["content"] = response.text
         processed_data.append(image_data)
     return processed_data
@@ -78,8 +85,9 @@ def process_table_chunks(chunks):
             "stream": False,
             "temperature": 0.2,
           }
-          response = requests.post(url, json=data)
-          response.raise_for_status()
+          with span("describe", content_type="table"):
+            response = requests.post(url, json=data)
+            response.raise_for_status()
 
           table_data["content"] = response.json().get(
               "response", "No response from model"
@@ -114,6 +122,9 @@ def create_semantic_chunks(chunks):
             chunk_data = {
                 "content": chunk.text,
                 "content_type": "text",
+                "page_number": (
+                    chunk.metadata.page_number if hasattr(chunk, "metadata") else None
+                ),
                 "filename": (
                     chunk.metadata.filename if hasattr(chunk, "metadata") else ""
                 ),
@@ -123,6 +134,101 @@ def create_semantic_chunks(chunks):
     print(f"Created {len(processed_chunks)} semantic chunks from document")
     return processed_chunks
 
+def split_into_child_chunks(text, max_chars=250):
+    """Split a section into sentence-aligned pieces of at most max_chars."""
+    import re
+
+    sentences = re.split(r"(?<=[.!?])\s+|\n{2,}", text)
+    children, current = [], ""
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # Hard-wrap sentences that are longer than a whole child
+        while len(sentence) > max_chars:
+            if current:
+                children.append(current)
+                current = ""
+            children.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            children.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        children.append(current)
+    return children
+
+
+def build_hierarchical_chunks(section_chunks, max_child_chars=250, max_parent_chars=2000):
+    """
+    Group section chunks into parents and split them into small linked children.
+
+    Children are what gets embedded and matched. Each child records its
+    parent section and its previous/next child in reading order, so
+    retrieval can expand a match to more context with one multi-get.
+
+    Consecutive chunks of the same document are merged into parents of up
+    to `max_parent_chars`. The cached text chunks are ~350 characters
+    (chunk_by_title defaults), so without merging a parent would add
+    hardly any context over its children.
+
+    Args:
+        section_chunks: Text chunks as produced by create_semantic_chunks
+        max_child_chars: Maximum length of a child chunk
+        max_parent_chars: Maximum length of a merged parent section
+
+    Returns:
+        tuple: (parent sections, child chunks)
+    """
+    import os
+
+    groups = []
+    for section in section_chunks:
+        filename = section.get("filename") or section.get("file_name", "")
+        last = groups[-1] if groups else None
+        if (
+            last is not None
+            and last["filename"] == filename
+            and len(last["content"]) + 2 + len(section["content"]) <= max_parent_chars
+        ):
+            last["content"] += "\n\n" + section["content"]
+        else:
+            groups.append({"first": section, "filename": filename, "content": section["content"]})
+
+    parents, children = [], []
+    for idx, group in enumerate(groups):
+        filename = group["filename"]
+        parent_id = f"{os.path.splitext(filename)[0] or 'doc'}-s{idx:05d}"
+        parents.append(
+            {
+                "parent_id": parent_id,
+                "content": group["content"],
+                "filename": filename,
+                "page_number": group["first"].get("page_number"),
+            }
+        )
+        for j, text in enumerate(split_into_child_chunks(group["content"], max_child_chars)):
+            children.append(
+                {
+                    **group["first"],
+                    "content": text,
+                    "chunk_id": f"{parent_id}-c{j:03d}",
+                    "parent_id": parent_id,
+                }
+            )
+
+    # Link neighbors across section boundaries within the same document
+    for prev, child in zip(children, children[1:]):
+        if prev.get("filename") == child.get("filename"):
+            prev["next_id"] = child["chunk_id"]
+            child["prev_id"] = prev["chunk_id"]
+
+    print(f"Created {len(children)} child chunks from {len(parents)} sections")
+    return parents, children
+
+
 def save_processed_chunks_to_file(processed_chunks, json_path: str):
     """Serialize parsed elements to a JSON file with progress bar."""
     print("[INFO] Saving processed chunks to JSON...")
@@ -134,8 +240,14 @@ def save_processed_chunks_to_file(processed_chunks, json_path: str):
 
 # Example usage
 if __name__ == "__main__":
+  from unstructured.chunking.title import chunk_by_title
+  from parser import get_parsed_elements
+
   elements = get_parsed_elements()
-  raw_text_chunks = chunk_by_title(elements)
+  # Only used by create_semantic_chunks below, which is disabled: the text
+  # cache keeps its chunk_by_title sizes and build_hierarchical_chunks
+  # merges them into ~2000 character parents at ingestion.
+  raw_text_chunks = chunk_by_title(elements, max_characters=2000, new_after_n_chars=1500)
 
 #   # processed_image_chunks = process_image_chunks(elements)
 #   # save_processed_chunks_to_file(processed_image_chunks, json_output_image_chunks_path)
@@ -0,0 +1,348 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+
+from tracing import incr
+
+# Embedding models the index can hold vectors for. Every model writes its own
+# knn_vector field, so a new model is filled in next to the current one and
+# the switch is a configuration change. "nomic-embed-text" keeps the original
+# `embedding` field.
+EMBEDDING_MODELS = {
+    "nomic-embed-text": {"field": "embedding"},
+    "mxbai-embed-large": {"field": "embedding_mxbai_embed_large"},
+    "all-minilm": {"field": "embedding_all_minilm"},
+}
+
+# The active model answers queries. A shadow model is written next to it on
+# ingestion and searched in the background to compare results, e.g.
+#   LOCALRAG_SHADOW_EMBEDDING_MODEL=mxbai-embed-large
+active_embedding_model = os.getenv("LOCALRAG_EMBEDDING_MODEL", "nomic-embed-text")
+shadow_embedding_model = os.getenv("LOCALRAG_SHADOW_EMBEDDING_MODEL") or None
+shadow_log_path = os.getenv("LOCALRAG_SHADOW_LOG", "shadow_eval.jsonl")
+max_shadow_searches = 2
+
+_shadow_slots = threading.BoundedSemaphore(max_shadow_searches)
+_shadow_log_lock = threading.Lock()
+
+
+def embedding_field(model):
+    """Name of the knn_vector field holding a model's embeddings."""
+    if model in EMBEDDING_MODELS:
+        return EMBEDDING_MODELS[model]["field"]
+    return "embedding_" + re.sub(r"[^a-z0-9]+", "_", model.lower()).strip("_")
+
+
+def ingestion_models():
+    """Models new chunks are embedded with: the active and the shadow model."""
+    models = [active_embedding_model]
+    if shadow_embedding_model and shadow_embedding_model != active_embedding_model:
+        models.append(shadow_embedding_model)
+    return models
+
+
+def embedding_dimension(model):
+    """Get a model's dimension from a sample embedding."""
+    from helper import get_embedding
+
+    return len(get_embedding("Sample text for dimension detection", model))
+
+
+def add_embedding_field(client, index_name, model, index_profile=None):
+    """
+    Add a model's vector field to an existing index.
+
+    Args:
+        client: OpenSearch client instance
+        index_name: Name of the index
+        model: Ollama embedding model name
+        index_profile: k-NN profile from index_profiles.INDEX_PROFILES
+
+    Returns:
+        str: Name of the field
+
+    Raises:
+        ValueError: The profile uses PQ and no model is trained for the field
+    """
+    from index_profiles import (
+        build_knn_field_mapping,
+        get_index_profile,
+        get_pq_model_state,
+        pq_model_id,
+    )
+
+    field = embedding_field(model)
+    dimension = embedding_dimension(model)
+    if get_index_profile(index_profile)["encoding"] == "pq":
+        # The PQ model is trained for one field and dimension
+        model_id = pq_model_id(index_profile, field)
+        if get_pq_model_state(client, model_id) != "created":
+            raise ValueError(
+                f"Train the PQ model '{model_id}' for '{field}' ({dimension} dimensions) "
+                "with index_profiles.train_pq_model_from_vectors before adding the field"
+            )
+    client.indices.put_mapping(
+        index=index_name,
+        body={"properties": {field: build_knn_field_mapping(index_profile, dimension, field)}},
+    )
+    print(f"Added field '{field}' ({dimension} dimensions) for '{model}' to '{index_name}'.")
+    return field
+
+
+def migration_status(client, index_name, model):
+    """
+    Count the documents that already have a model's embedding.
+
+    Returns:
+        dict: model, field, total, embedded and whether the field is complete
+    """
+    field = embedding_field(model)
+    total = client.count(index=index_name)["count"]
+    exists = {"query": {"exists": {"field": field}}}
+    embedded = client.count(index=index_name, body=exists)["count"]
+    return {
+        "model": model,
+        "field": field,
+        "total": total,
+        "embedded": embedded,
+        "complete": embedded == total,
+    }
+
+
+def reembed_index(
+    client,
+    index_name,
+    model,
+    index_profile=None,
+    batch_size=32,
+    max_docs_per_s=20,
+    stop_event=None,
+):
+    """
+    Fill a model's field for every document that does not have it yet.
+
+    Only documents missing the field are read, so an interrupted run picks
+    up where it stopped. Batches are paced to `max_docs_per_s` to leave
+    Ollama and OpenSearch capacity for queries.
+
+    Args:
+        client: OpenSearch client instance
+        index_name: Name of the index
+        model: Ollama embedding model name
+        index_profile: k-NN profile the vectors are encoded for
+        batch_size: Documents per embedding call and bulk update
+        max_docs_per_s: Throttle, None to run at full speed
+        stop_event: threading.Event to stop between batches
+
+    Returns:
+        int: Number of documents updated
+    """
+    from opensearchpy import helpers
+
+    from helper import get_embeddings
+    from index_profiles import encode_vector
+    from tracing import span
+
+    field = embedding_field(model)
+    query = {
+        "query": {"bool": {"must_not": {"exists": {"field": field}}}},
+        "_source": ["content"],
+    }
+
+    def flush(batch):
+        with span("embed", model=model, documents=len(batch)):
+            vectors = get_embeddings([hit["_source"].get("content", "") for hit in batch], model)
+        operations = [
+            {
+                "_op_type": "update",
+                "_index": index_name,
+                "_id": hit["_id"],
+                "doc": {field: encode_vector(vector, index_profile)},
+            }
+            for hit, vector in zip(batch, vectors)
+        ]
+        with span("bulk_index", documents=len(operations)):
+            success, _ = helpers.bulk(client, operations, stats_only=True)
+        return success
+
+    started = time.perf_counter()
+    updated, batch = 0, []
+    for hit in helpers.scan(client, index=index_name, query=query, size=batch_size):
+        batch.append(hit)
+        if len(batch) < batch_size:
+            continue
+        updated += flush(batch)
+        batch = []
+        print(f"Re-embedded {updated} documents with '{model}'")
+        if stop_event is not None and stop_event.is_set():
+            print(f"Re-embedding with '{model}' stopped")
+            return updated
+        if max_docs_per_s:
+            # Sleep until the average rate is back under the limit
+            ahead_s = updated / max_docs_per_s - (time.perf_counter() - started)
+            if ahead_s > 0:
+                time.sleep(ahead_s)
+    if batch:
+        updated += flush(batch)
+
+    print(f"Re-embedding complete: {updated} documents updated with '{model}'")
+    return updated
+
+
+def start_background_reembedding(client, index_name, model, **kwargs):
+    """
+    Run reembed_index in a daemon thread.
+
+    Returns:
+        tuple: (thread, stop_event), set the event to stop after the current batch
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=reembed_index,
+        args=(client, index_name, model),
+        kwargs={**kwargs, "stop_event": stop_event},
+        daemon=True,
+    )
+    thread.start()
+    return thread, stop_event
+
+
+def _log_shadow_result(record):
+    with _shadow_log_lock:
+        with open(shadow_log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def run_shadow_search(search_type, query_text, hits, latency_ms, search):
+    """
+    Repeat a search with the shadow model in the background and log the difference.
+
+    The user's results are never affected. Shadow searches are dropped when
+    `max_shadow_searches` are already running.
+
+    Args:
+        search_type: "semantic" or "hybrid"
+        query_text: The query text
+        hits: Results of the active model
+        latency_ms: Search latency of the active model
+        search: Callable taking the embedding model and returning hits
+    """
+    if not shadow_embedding_model or shadow_embedding_model == active_embedding_model:
+        return
+    if not _shadow_slots.acquire(blocking=False):
+        incr("shadow_search_dropped")
+        return
+
+    def compare():
+        try:
+            started = time.perf_counter()
+            shadow_hits = search(shadow_embedding_model)
+            shadow_ms = (time.perf_counter() - started) * 1000
+
+            active_ids = [hit["_id"] for hit in hits]
+            shadow_ids = [hit["_id"] for hit in shadow_hits]
+            # Share of the active results the shadow model also returns
+            overlap = (
+                len(set(active_ids) & set(shadow_ids)) / len(active_ids) if active_ids else None
+            )
+            _log_shadow_result(
+                {
+                    "time": time.time(),
+                    "search_type": search_type,
+                    "query": query_text,
+                    "active_model": active_embedding_model,
+                    "shadow_model": shadow_embedding_model,
+                    "active_ms": latency_ms,
+                    "shadow_ms": shadow_ms,
+                    "overlap": overlap,
+                    "active_top_in_shadow": (
+                        shadow_ids.index(active_ids[0]) + 1
+                        if active_ids and active_ids[0] in shadow_ids
+                        else None
+                    ),
+                    "active_ids": active_ids,
+                    "shadow_ids": shadow_ids,
+                }
+            )
+            incr("shadow_search")
+        except Exception as e:
+            print(f"Shadow search error: {e}")
+        finally:
+            _shadow_slots.release()
+
+    # The copied context keeps the shadow search's spans in the request's trace
+    threading.Thread(target=contextvars.copy_context().run, args=(compare,), daemon=True).start()
+
+
+def summarize_shadow_log(path=shadow_log_path):
+    """
+    Aggregate the shadow log into overlap and latency differences per model pair.
+
+    Returns:
+        list: One summary dict per (active, shadow) model pair
+    """
+    from helper import percentile
+
+    pairs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            pairs.setdefault((record["active_model"], record["shadow_model"]), []).append(record)
+
+    summaries = []
+    for (active, shadow), records in pairs.items():
+        overlaps = [r["overlap"] for r in records if r["overlap"] is not None]
+        latency_diffs = [r["shadow_ms"] - r["active_ms"] for r in records]
+        summaries.append(
+            {
+                "active_model": active,
+                "shadow_model": shadow,
+                "queries": len(records),
+                "overlap_mean": sum(overlaps) / len(overlaps) if overlaps else None,
+                "active_top_kept": (
+                    sum(1 for r in records if r["active_top_in_shadow"]) / len(records)
+                ),
+                "latency_diff_ms_p50": percentile(latency_diffs, 50),
+                "latency_diff_ms_p95": percentile(latency_diffs, 95),
+            }
+        )
+    return summaries
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Migrate the index to another embedding model")
+    arg_parser.add_argument("command", choices=["add-field", "reembed", "status", "shadow-report"])
+    arg_parser.add_argument("--model", default=shadow_embedding_model)
+    arg_parser.add_argument("--index", default="localrag")
+    arg_parser.add_argument("--index-profile", default=None, help="LOCALRAG_INDEX_PROFILE by default")
+    arg_parser.add_argument("--batch-size", type=int, default=32)
+    arg_parser.add_argument("--max-docs-per-s", type=float, default=20)
+    args = arg_parser.parse_args()
+
+    if args.command == "shadow-report":
+        print(json.dumps(summarize_shadow_log(), indent=2))
+    else:
+        from helper import get_opensearch_client
+
+        if not args.model:
+            arg_parser.error("--model or LOCALRAG_SHADOW_EMBEDDING_MODEL is required")
+        client = get_opensearch_client("localhost", 9200)
+        if args.command == "add-field":
+            add_embedding_field(client, args.index, args.model, args.index_profile)
+        elif args.command == "reembed":
+            reembed_index(
+                client, args.index, args.model, args.index_profile,
+                args.batch_size, args.max_docs_per_s,
+            )
+
+        status = migration_status(client, args.index, args.model)
+        print(json.dumps(status, indent=2))
+        if status["complete"]:
+            print(
+                f"'{args.model}' is complete, set LOCALRAG_EMBEDDING_MODEL={args.model} to switch"
+            )
@@ -2,13 +2,84 @@ import time
 
 import gradio as gr
 
-from generation import generate_rag_response
+from admission import (
+    Overloaded,
+    RateLimited,
+    get_qa_service,
+    max_active_requests,
+    max_queued_requests,
+)
+
+
+def build_filters(content_types, filename, page_from, page_to, fiscal_year):
+    """Turn the filter inputs into the filters dict used by retrieval"""
+    filters = {}
+    if content_types:
+        filters["content_types"] = content_types
+    if filename and filename.strip():
+        filters["filenames"] = [name.strip() for name in filename.split(",") if name.strip()]
+    if page_from or page_to:
+        filters["page_range"] = (page_from or None, page_to or None)
+    if fiscal_year:
+        filters["fiscal_year"] = int(fiscal_year)
+    return filters or None
+
+
+def citation_image(citation):
+    """Load a cited image from the blob store as a markdown image, or return None"""
+    from blob_store import get_base64_image
+
+    if not citation.get("image_ref"):
+        return None
+    try:
+        image_base64 = get_base64_image(citation["image_ref"])
+    except FileNotFoundError:
+        return None
+    mime_type = "image/jpeg" if image_base64.startswith("/9j/") else "image/png"
+    return f"![page {citation['page_number']}](data:{mime_type};base64,{image_base64})"
+
+
+def format_citations(citations):
+    """Render the sources of an answer as a markdown list, with cited images"""
+    if not citations:
+        return ""
+    lines = ["\n\n**Sources**"]
+    for i, citation in enumerate(citations):
+        location = citation["filename"] or "unknown document"
+        if citation["page_number"]:
+            location += f", page {citation['page_number']}"
+        snippet = " ".join((citation["snippet"] or "").split())
+        lines.append(f"{i + 1}. {location} ({citation['content_type']}): {snippet}")
+        image = citation_image(citation)
+        if image:
+            lines.append(f"\n   {image}\n")
+    return "\n".join(lines)
+
+
+def answer_chunks(
+    query, search_type, model_type, rerank, filters, expand, client_id, table_fast_path=False
+):
+    """Start or join the streamed answer through the shared Q&A service"""
+    return get_qa_service().answer_stream(
+        query, client_id, search_type=search_type, top_k=5, model_type=model_type,
+        rerank=rerank, filters=filters, expand=expand, citations=True,
+        table_fast_path=table_fast_path,
+    )
 
 
-def process_query_stream(query, search_type, model_type):
+def process_query_stream(
+    query, search_type, model_type, rerank=False, filters=None, expand=None,
+    client_id="anonymous", table_fast_path=False,
+):
     """Process the query and stream the response more efficiently"""
     full_response = ""
-    for chunk in generate_rag_response(query, search_type, 5, model_type, stream=True):
+    for chunk in answer_chunks(
+        query, search_type, model_type, rerank, filters, expand, client_id, table_fast_path
+    ):
+        # The sources come last, after the answer text
+        if isinstance(chunk, dict):
+            full_response += format_citations(chunk["citations"])
+            break
         full_response += chunk
 
         # Only yield every few characters to reduce UI updates
@@ -20,9 +91,20 @@ def process_query_stream(query, search_type, model_type):
     yield full_response
 
 
-def process_query_normal(query, search_type, model_type):
+def process_query_normal(
+    query, search_type, model_type, rerank=False, filters=None, expand=None,
+    client_id="anonymous", table_fast_path=False,
+):
     """Process the query and return the complete response"""
-    return generate_rag_response(query, search_type, 5, model_type, stream=False)
+    answer, citations = "", []
+    for chunk in answer_chunks(
+        query, search_type, model_type, rerank, filters, expand, client_id, table_fast_path
+    ):
+        if isinstance(chunk, dict):
+            citations = chunk["citations"]
+        else:
+            answer += chunk
+    return answer + format_citations(citations)
 
 
 # Create Gradio interface
@@ -60,10 +142,10 @@ with gr.Blocks(title="LocalRAG Q&A System", theme="soft", css="""
                 )
 
                 model_type = gr.Radio(
-                    ["gemini"],
+                    ["auto", "gemini", "ollama"],
                     label="AI Model",
-                    value="gemini",
-                    info="Select which model generates your answer",
+                    value="auto",
+                    info="Auto picks a model by question length and backend latency",
                 )
 
             stream_checkbox = gr.Checkbox(
@@ -72,16 +154,63 @@ with gr.Blocks(title="LocalRAG Q&A System", theme="soft", css="""
                 info="See the answer as it's being generated",
             )
 
+            rerank_checkbox = gr.Checkbox(
+                label="Rerank Results",
+                value=False,
+                info="Rescore more candidates with a cross-encoder before answering",
+            )
+
+            table_fast_path_checkbox = gr.Checkbox(
+                label="Answer Figures from Tables",
+                value=False,
+                info="Answer clear numeric questions about a year directly from the report tables",
+            )
+
+            expand_radio = gr.Radio(
+                ["none", "parent", "neighbors"],
+                label="Context Expansion",
+                value="none",
+                info="Widen matched passages to their section or surrounding text",
+            )
+
+            with gr.Accordion("Filters", open=False):
+                content_type_filter = gr.CheckboxGroup(
+                    ["text", "table", "image"],
+                    label="Content Types",
+                    info="Leave empty to search all content",
+                )
+                filename_filter = gr.Textbox(
+                    label="Documents",
+                    placeholder="e.g. sample.pdf (comma separated)",
+                )
+                with gr.Row():
+                    page_from_filter = gr.Number(
+                        label="From Page", precision=0,
+                        info="Only tables and images have page numbers, text is excluded",
+                    )
+                    page_to_filter = gr.Number(label="To Page", precision=0)
+                    fiscal_year_filter = gr.Number(label="Fiscal Year", precision=0)
+
             submit_btn = gr.Button("Generate Answer", variant="primary")
 
         with gr.Column(scale=2, elem_classes="box-border"):
             output = gr.Markdown(value="Answer", elem_classes="custom-md-box")
 
     # Handle form submission based on streaming preference
-    def on_submit(query, search_type, model_type, stream):
+    def on_submit(
+        query, search_type, model_type, stream, rerank, table_fast_path, expand,
+        content_types, filename, page_from, page_to, fiscal_year,
+        request: gr.Request,
+    ):
         if not query.strip():
             return "Please enter a question."
 
+        # Rate limits apply per client address
+        client_id = request.client.host if request and request.client else "anonymous"
+
+        filters = build_filters(content_types, filename, page_from, page_to, fiscal_year)
+        expand = None if expand == "none" else expand
+
         # Initial feedback to user
         yield (
             "Retrieving relevant information..."
@@ -89,18 +218,36 @@ with gr.Blocks(title="LocalRAG Q&A System", theme="soft", css="""
             else "Retrieving relevant information..."
         )
 
-        if stream:
-            yield from process_query_stream(query, search_type, model_type)
-        else:
-            return process_query_normal(query, search_type, model_type)
+        try:
+            if stream:
+                yield from process_query_stream(
+                    query, search_type, model_type, rerank, filters, expand, client_id,
+                    table_fast_path,
+                )
+            else:
+                yield process_query_normal(
+                    query, search_type, model_type, rerank, filters, expand, client_id,
+                    table_fast_path,
+                )
+        except (RateLimited, Overloaded) as e:
+            yield f"{e}."
 
     submit_btn.click(
         on_submit,
-        inputs=[query_input, search_type, model_type, stream_checkbox],
+        inputs=[
+            query_input, search_type, model_type, stream_checkbox, rerank_checkbox,
+            table_fast_path_checkbox, expand_radio,
+            content_type_filter, filename_filter, page_from_filter, page_to_filter,
+            fiscal_year_filter,
+        ],
         outputs=output,
         show_progress="minimal",  # Add this for visual feedback
     )
 
 # Launch the app
 if __name__ == "__main__":
-    demo.queue().launch()
\ No newline at end of file
+    from tracing import serve_metrics
+
+    serve_metrics()
+    # Admission control in the Q&A service decides what waits or is shed
+    demo.queue(default_concurrency_limit=max_active_requests + max_queued_requests).launch()
\ No newline at end of file
@@ -1,21 +1,21 @@
+import contextvars
 import json
 import os
+import queue
+import re
+import threading
+import time
 
-from google import genai
-from google.genai import types
-import requests
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
 
 # Import retrieval functions
-from retrieval import hybrid_search, keyword_search, semantic_search
+from helper import get_gemini_client
+from retrieval import expand_hits, hybrid_search, keyword_search, semantic_search
+from tracing import incr, span
 
 # Load environment variables
 load_dotenv()
 
-# The client gets the API key from the environment variable `GEMINI_API_KEY`.
-client = genai.Client()
-
 # Define RAG prompt template
 RAG_PROMPT_TEMPLATE = """
 You are an AI assistant helping answer questions about Retrieval-Augmented Generation (RAG).
@@ -31,17 +31,20 @@ USER QUESTION:
 YOUR ANSWER (be comprehensive, accurate, and helpful):
 """
 
-prompt = PromptTemplate(
-    input_variables=["context", "question"],
-    template=RAG_PROMPT_TEMPLATE,
-)
 
+def generate_with_gemini(
+    prompt_text, model_name="gemini-2.5-flash", stream=False, raise_errors=False
+):
+    """
+    Generate response using Google's Gemini model with robust error handling.
 
-def generate_with_gemini(prompt_text, model_name="gemini-1.5-flash", stream=False):
-    """Generate response using Google's Gemini model with robust error handling"""
+    With `raise_errors`, failures are raised instead of returned as text so
+    the backend pool can fall back to another backend.
+    """
     try:
         # 1. Initialize model
         print(f"Initializing Gemini model: {model_name}")
+        client = get_gemini_client()
 
         # 2. Safety check for prompt length
         if len(prompt_text) > 30000:
@@ -67,22 +70,29 @@ def generate_with_gemini(prompt_text, model_name="gemini-1.5-flash", stream=Fals
         # 5. Handle streaming vs non-streaming differently
         if stream:
             print("Starting streaming response generation...")
-            response_generator = client.models.generate_content_stream(
-                model=model_name,
-                contents=prompt_text,
-            )
-
-            # Process stream chunks correctly
-            for chunk in response_generator:
-                # Most direct way to get text from a chunk
-                if hasattr(chunk, "text"):
-                    if chunk.text:  # Only yield non-empty text
-                        yield chunk.text
-                # Alternative way through parts
-                elif hasattr(chunk, "parts"):
-                    for part in chunk.parts:
-                        if hasattr(part, "text") and part.text:
-                            yield part.text
+            with span("llm_call", backend="gemini", model=model_name) as s:
+                response_generator = client.models.generate_content_stream(
+                    model=model_name,
+                    contents=prompt_text,
+                )
+
+                # Process stream chunks correctly
+                for chunk in response_generator:
+                    # The last chunk carries the token usage of the request
+                    usage = getattr(chunk, "usage_metadata", None)
+                    if usage:
+                        s.set("prompt_tokens", usage.prompt_token_count)
+                        s.set("output_tokens", usage.candidates_token_count)
+
+                    # Most direct way to get text from a chunk
+                    if hasattr(chunk, "text"):
+                        if chunk.text:  # Only yield non-empty text
+                            yield chunk.text
+                    # Alternative way through parts
+                    elif hasattr(chunk, "parts"):
+                        for part in chunk.parts:
+                            if hasattr(part, "text") and part.text:
+                                yield part.text
         else:
             print("Requesting non-streaming response...")
             response = client.models.generate_content(
@@ -103,14 +113,24 @@ def generate_with_gemini(prompt_text, model_name="gemini-1.5-flash", stream=Fals
 
         error_msg = f"Error with Gemini generation: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
+        if raise_errors:
+            raise
         if stream:
             yield error_msg
         else:
             return error_msg
 
 
-def generate_with_ollama(prompt_text, model_name="deepseek-r1:1.5b", stream=False):
-    """Generate response using Ollama with Deepseek model"""
+def generate_with_ollama(
+    prompt_text, model_name="deepseek-r1:1.5b", stream=False, raise_errors=False
+):
+    """
+    Generate response using Ollama with Deepseek model.
+
+    With `raise_errors`, failures are raised instead of returned as text.
+    """
+    import requests
+
     try:
         url = "http://localhost:11434/api/generate"
         data = {
@@ -121,102 +141,624 @@ def generate_with_ollama(prompt_text, model_name="deepseek-r1:1.5b", stream=Fals
         }
 
         if stream:
-            response = requests.post(url, json=data, stream=True)
-            response.raise_for_status()
-
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode("utf-8"))
-                        if "response" in chunk:
-                            yield chunk["response"]
-                    except json.JSONDecodeError:
-                        continue
+            with span("llm_call", backend="ollama", model=model_name) as s:
+                # Connect quickly, but allow slow token generation
+                response = requests.post(url, json=data, stream=True, timeout=(3, 120))
+                response.raise_for_status()
+
+                for line in response.iter_lines():
+                    if line:
+                        try:
+                            chunk = json.loads(line.decode("utf-8"))
+                            if "response" in chunk:
+                                yield chunk["response"]
+                            # The final chunk carries the token counts
+                            if chunk.get("done"):
+                                s.set("prompt_tokens", chunk.get("prompt_eval_count"))
+                                s.set("output_tokens", chunk.get("eval_count"))
+                        except json.JSONDecodeError:
+                            continue
         else:
             response = requests.post(url, json=data)
             response.raise_for_status()
             return response.json().get("response", "No response generated")
     except Exception as e:
         error_msg = f"Error generating response with Ollama: {str(e)}"
+        if raise_errors:
+            raise
         if stream:
             yield error_msg
         else:
             return error_msg
 
 
-def generate_rag_response(
-    query, search_type="hybrid", top_k=5, model_type="gemini", stream=False
-):
+# Generation backends the pool routes between. `tier` "fast" backends get
+# short factual questions, `hedge_after_ms` is the time to first token after
+# which the next backend is started, `timeout_s` the longest wait for a chunk.
+GENERATION_BACKENDS = {
+    "gemini-flash": {
+        "provider": "gemini",
+        "model": "gemini-2.5-flash",
+        "tier": "quality",
+        "max_concurrency": 8,
+        "expected_ttft_ms": 800,
+        "hedge_after_ms": 2500,
+        "timeout_s": 60,
+    },
+    "gemini-flash-lite": {
+        "provider": "gemini",
+        "model": "gemini-2.5-flash-lite",
+        "tier": "fast",
+        "max_concurrency": 8,
+        "expected_ttft_ms": 400,
+        "hedge_after_ms": 1500,
+        "timeout_s": 30,
+    },
+    "ollama-deepseek": {
+        "provider": "ollama",
+        "model": "deepseek-r1:1.5b",
+        "tier": "fast",
+        "max_concurrency": 2,
+        "expected_ttft_ms": 1500,
+        "hedge_after_ms": 5000,
+        "timeout_s": 120,
+    },
+}
+health_check_interval_s = 30
+unhealthy_cooldown_s = 30
+# Consecutive failures before a backend is taken out for the cooldown
+failure_threshold = 3
+
+SHORT_FACTUAL_PATTERN = re.compile(
+    r"^\s*(what|who|when|where|which|how much|how many|is|are|was|were|did|does)\b",
+    re.IGNORECASE,
+)
+LONG_ANSWER_PATTERN = re.compile(r"\b(why|explain|compare|summari[sz]e|describe|discuss)\b", re.IGNORECASE)
+
+_backend_pool = None
+
+
+def is_short_factual(query, max_words=12):
+    """Short lookup-style questions that a smaller model answers well."""
+    return (
+        bool(query)
+        and len(query.split()) <= max_words
+        and bool(SHORT_FACTUAL_PATTERN.match(query))
+        and not LONG_ANSWER_PATTERN.search(query)
+    )
+
+
+def check_backend_health(backend):
     """
-    Generate RAG response using retrieved chunks.
+    Cheap health check of a backend.
+
+    Gemini needs an API key, Ollama must be reachable and have the model pulled.
+    """
+    if backend.provider == "gemini":
+        return bool(os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"))
+
+    import requests
+
+    try:
+        response = requests.get("http://localhost:11434/api/tags", timeout=1)
+        response.raise_for_status()
+    except Exception:
+        return False
+    names = {model.get("name") for model in response.json().get("models", [])}
+    return backend.model in names or f"{backend.model}:latest" in names
+
+
+class GenerationBackend:
+    """One model behind a provider, with its concurrency limit and latency stats."""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.provider = config["provider"]
+        self.model = config["model"]
+        self.tier = config.get("tier", "quality")
+        self.max_concurrency = config.get("max_concurrency", 4)
+        self.hedge_after_ms = config.get("hedge_after_ms", 3000)
+        self.timeout_s = config.get("timeout_s", 60)
+        # Moving average of the time to first token, seeded with the expectation
+        self.ttft_ms = config.get("expected_ttft_ms", 1000)
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._healthy = None
+        self._checked_at = 0.0
+        self._unhealthy_until = 0.0
+        self._consecutive_failures = 0
+
+    def is_healthy(self):
+        now = time.monotonic()
+        if now < self._unhealthy_until:
+            return False
+        if self._healthy is None or now - self._checked_at > health_check_interval_s:
+            self._healthy = check_backend_health(self)
+            self._checked_at = now
+        return self._healthy
+
+    def acquire(self, timeout=None):
+        """Take a concurrency slot, without waiting unless a timeout is given."""
+        if timeout is None:
+            acquired = self._slots.acquire(blocking=False)
+        else:
+            acquired = self._slots.acquire(timeout=timeout)
+        if acquired:
+            with self._lock:
+                self.in_flight += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def expected_ttft_ms(self):
+        """Expected time to first token, growing with the share of busy slots."""
+        return self.ttft_ms * (1 + self.in_flight / self.max_concurrency)
+
+    def record_ttft(self, ms):
+        with self._lock:
+            self.ttft_ms = 0.8 * self.ttft_ms + 0.2 * ms
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit after `failure_threshold` in a row."""
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= failure_threshold:
+                self._unhealthy_until = time.monotonic() + unhealthy_cooldown_s
+                self._consecutive_failures = 0
+                incr(f"generation_circuit_open_{self.name}")
+        incr(f"generation_failure_{self.name}")
+
+    def stream(self, prompt_text):
+        # Looked up at call time so the providers can be swapped (see benchmark.py)
+        generate = generate_with_gemini if self.provider == "gemini" else generate_with_ollama
+        return generate(prompt_text, model_name=self.model, stream=True, raise_errors=True)
+
+
+class _BackendCall:
+    """
+    One call to a backend holding one of its slots.
+
+    A provider call blocked on its first token cannot be interrupted, so a
+    cancelled call gives its slot back at once and the pump thread finishes
+    in the background, bounded by the provider's request timeout.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.cancelled = threading.Event()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.backend.release()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.release()
+
+
+def _pump(call, prompt_text, out):
+    """Feed a backend's chunks into the shared queue until done or cancelled."""
+    backend = call.backend
+    started = time.perf_counter()
+    chunks = None
+    try:
+        chunks = backend.stream(prompt_text)
+        first = True
+        for chunk in chunks:
+            if call.cancelled.is_set():
+                break
+            if first:
+                backend.record_ttft((time.perf_counter() - started) * 1000)
+                backend.record_success()
+                first = False
+            out.put(("chunk", backend, chunk))
+        if first and not call.cancelled.is_set():
+            # Finishing without any text is a failure, the pool falls back
+            incr(f"generation_empty_{backend.name}")
+            out.put(("error", backend, RuntimeError(f"{backend.name} returned no text")))
+        else:
+            out.put(("done", backend, None))
+    except Exception as e:
+        backend.record_failure()
+        out.put(("error", backend, e))
+    finally:
+        if chunks is not None and hasattr(chunks, "close"):
+            chunks.close()
+        call.release()
+
+
+class BackendPool:
+    """
+    Route generation requests across backends.
+
+    The first healthy backend with a free slot streams the answer. If it has
+    not produced a token after its `hedge_after_ms`, or fails before the
+    first token, the next backend is started and whichever answers first wins.
+    """
+
+    def __init__(self, configs=GENERATION_BACKENDS):
+        self.backends = [GenerationBackend(name, config) for name, config in configs.items()]
+
+    def route(self, query=None, model_type="auto"):
+        """
+        Order the healthy backends for a request, preferred first.
+
+        When no backend is healthy, all of them are tried anyway: a backend
+        in cooldown may have recovered, and refusing outright is worse.
+
+        Args:
+            query: User query, short factual questions prefer "fast" backends
+            model_type: "auto", a provider ("gemini", "ollama") or a backend name
+
+        Returns:
+            list: Backends to try in order, the rest serve as fallbacks
+        """
+        healthy = [b for b in self.backends if b.is_healthy()] or list(self.backends)
+        tier = "fast" if is_short_factual(query) else "quality"
+        if model_type in (None, "auto"):
+            preferred = lambda b: True
+        else:
+            preferred = lambda b: model_type in (b.provider, b.name)
+        return sorted(
+            healthy,
+            key=lambda b: (not preferred(b), b.tier != tier, b.expected_ttft_ms()),
+        )
+
+    def stream(self, prompt_text, query=None, model_type="auto"):
+        """Yield the answer chunks of the winning backend."""
+        pending = self.route(query, model_type)
+        if not pending:
+            yield "No generation backend is available. Please try again later."
+            return
+
+        out = queue.Queue()
+        running = {}
+        tried = set()
+
+        def start_next(wait_s=None):
+            while pending:
+                backend = pending.pop(0)
+                if backend.acquire():
+                    break
+            else:
+                # Every backend is busy, queue for the preferred idle one
+                candidates = [b for b in self.route(query, model_type) if b not in tried]
+                if not candidates:
+                    return None
+                backend = candidates[0]
+                if not backend.acquire(timeout=backend.timeout_s if wait_s is None else wait_s):
+                    return None
+            call = _BackendCall(backend)
+            running[backend] = call
+            tried.add(backend)
+            # The copied context keeps the backend's spans in the request's trace
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(_pump, call, prompt_text, out),
+                daemon=True,
+            ).start()
+            return backend
+
+        winner = None
+        with span("route", model_type=model_type) as s:
+            current = start_next()
+            s.set("backend", current.name if current else None)
+        if current is None:
+            yield "All generation backends are busy. Please try again later."
+            return
+
+        try:
+            while running:
+                hedging = winner is None and pending
+                wait_s = current.hedge_after_ms / 1000 if hedging else (winner or current).timeout_s
+                try:
+                    kind, backend, payload = out.get(timeout=wait_s)
+                except queue.Empty:
+                    if hedging:
+                        # Slow first token: race the next backend
+                        incr("generation_hedged")
+                        current = start_next(wait_s=0) or current
+                        continue
+                    incr("generation_timeout")
+                    yield "\n\n[Generation timed out]"
+                    return
+
+                if winner is not None and backend is not winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = backend
+                        for other, call in running.items():
+                            if other is not winner:
+                                call.cancel()
+                        incr(f"generation_backend_{winner.name}")
+                    yield payload
+                elif kind == "done":
+                    running.pop(backend)
+                    return
+                else:  # error
+                    running.pop(backend)
+                    if winner is backend:
+                        yield f"\n\n[Generation failed: {payload}]"
+                        return
+                    if not running:
+                        current = start_next(wait_s=1)
+                        if current is None:
+                            yield f"Error generating response: {payload}"
+                            return
+                        incr("generation_fallback")
+        finally:
+            for call in running.values():
+                call.cancel()
+
+
+def get_backend_pool():
+    """Create the generation backend pool on first use."""
+    global _backend_pool
+    if _backend_pool is None:
+        _backend_pool = BackendPool()
+    return _backend_pool
+
+
+def build_rag_prompt(query, results, table_facts=None):
+    """
+    Format retrieved hits into the RAG prompt.
 
     Args:
         query: User query
-        search_type: Type of search (keyword, semantic, hybrid)
-        top_k: Number of chunks to retrieve
-        model_type: Type of model to use (gemini, ollama)
-        stream: Whether to stream the response
+        results: Search hits with `_source`
+        table_facts: Optional facts from the table store to ground numbers
+
+    Returns:
+        str: Prompt text
+    """
+    contexts = []
+    if table_facts:
+        from table_store import format_fact
+
+        facts_text = "\n".join(format_fact(fact) for fact in table_facts)
+        contexts.append(f"[Structured table facts]\n{facts_text}")
+    for i, hit in enumerate(results):
+        source = hit["_source"]
+        content = source.get("content", "")
+        content_type = source.get("content_type", "unknown")
+
+        # Add metadata if available
+        metadata_info = ""
+        if "metadata" in source and source["metadata"]:
+            if "caption" in source["metadata"] and source["metadata"]["caption"]:
+                metadata_info += f"\nCaption: {source['metadata']['caption']}"
+
+        context_entry = (
+            f"[Document {i+1} - {content_type}]{metadata_info}\n{content}"
+        )
+        contexts.append(context_entry)
+
+    # Format the prompt using the template
+    context_text = "\n\n---\n\n".join(contexts)
+    return RAG_PROMPT_TEMPLATE.format(context=context_text, question=query)
+
+
+def generate_text(prompt_text, model_type="auto", query=None):
+    """
+    Generate a complete answer for a prompt.
+
+    The backend functions are generators, so the answer is collected from
+    the backend pool's stream rather than from their non-streaming branch.
+    """
+    return "".join(get_backend_pool().stream(prompt_text, query, model_type))
+
+
+def _timed_stream(chunks, model_type):
+    """Re-yield a token stream inside a "generate" span marking the first token."""
+    with span("generate", model_type=model_type) as s:
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                s.mark("first_token")
+            yield chunk
+
+
+def build_citations(results, snippet_chars=200):
+    """
+    List the sources of an answer.
+
+    Args:
+        results: Search hits, optionally with `highlight` fragments
+        snippet_chars: Length of the snippet when no highlight is available
 
     Returns:
-        Generated response or generator for streaming
+        list: One dict per hit with doc_id, page_number, filename,
+            content_type, snippet and image_ref (blob digest of images)
     """
+    citations = []
+    for hit in results:
+        source = hit.get("_source", {})
+        fragments = hit.get("highlight", {}).get("content")
+        if fragments:
+            snippet = " ... ".join(fragments)
+        else:
+            snippet = source.get("content", "")[:snippet_chars]
+        citations.append(
+            {
+                "doc_id": hit.get("_id"),
+                "page_number": source.get("page_number"),
+                "filename": (source.get("metadata") or {}).get("filename"),
+                "content_type": source.get("content_type"),
+                "snippet": snippet,
+                "image_ref": source.get("image_ref"),
+            }
+        )
+    return citations
+
+
+def _table_citations(table_facts):
+    """Cite the table cells a direct answer was read from."""
+    from table_store import format_fact
+
+    return [
+        {
+            "doc_id": f"table-{fact['table_id']}",
+            "page_number": fact["page_number"],
+            "filename": fact["file_name"],
+            "content_type": "table",
+            "snippet": format_fact(fact),
+        }
+        for fact in table_facts
+    ]
+
+
+def _rag_stream(
+    query,
+    search_type,
+    top_k,
+    model_type,
+    rerank,
+    rerank_candidates,
+    rerank_budget_ms,
+    filters,
+    use_tables,
+    table_fast_path,
+    expand,
+    citations,
+):
+    """Yield the answer text, followed by a {"citations": [...]} dict if requested."""
     try:
-        # Step 1: Retrieve relevant chunks based on search type
+        # Step 0: Table facts ground the prompt, and with the fast path a
+        # clearly numeric question may be answered from them directly
+        table_facts = []
+        if use_tables:
+            from table_store import answer_from_tables
+
+            direct_answer, table_facts = answer_from_tables(query, filters=filters)
+            if direct_answer and table_fast_path:
+                yield direct_answer
+                if citations:
+                    yield {"citations": _table_citations(table_facts[:1])}
+                return
+
+        # Step 1: Retrieve relevant chunks based on search type. Keyword
+        # matches are highlighted to give short citation snippets.
+        retrieve_k = max(top_k, rerank_candidates) if rerank else top_k
         if search_type == "keyword":
-            results = keyword_search(query, top_k=top_k)
+            results = keyword_search(
+                query, top_k=retrieve_k, filters=filters, highlight=citations
+            )
         elif search_type == "semantic":
-            results = semantic_search(query, top_k=top_k)
+            results = semantic_search(query, top_k=retrieve_k, filters=filters)
         else:  # hybrid
-            results = hybrid_search(query, top_k=top_k)
+            results = hybrid_search(
+                query, top_k=retrieve_k, filters=filters, highlight=citations
+            )
 
-        if not results:
-            message = "No relevant information found. Please try a different search type or refine your question."
-            if stream:
-                yield message
-                return
-            else:
-                return message
-
-        # Step 2: Format retrieved contexts
-        contexts = []
-        for i, hit in enumerate(results):
-            source = hit["_source"]
-            content = source.get("content", "")
-            content_type = source.get("content_type", "unknown")
-
-            # Add metadata if available
-            metadata_info = ""
-            if "metadata" in source and source["metadata"]:
-                if "caption" in source["metadata"] and source["metadata"]["caption"]:
-                    metadata_info += f"\nCaption: {source['metadata']['caption']}"
-
-            context_entry = (
-                f"[Document {i+1} - {content_type}]{metadata_info}\n{content}"
+        # Optional second stage: keep the best top_k candidates
+        if rerank and results:
+            from reranker import rerank as rerank_hits
+
+            results = rerank_hits(
+                query, results, top_k=top_k, latency_budget_ms=rerank_budget_ms
             )
-            contexts.append(context_entry)
 
-        # Step 3: Format the prompt using LangChain template
-        context_text = "\n\n---\n\n".join(contexts)
-        prompt_text = prompt.format(context=context_text, question=query)
+        # Cite the matched chunks, before they are widened for the prompt
+        cited = (build_citations(results) + _table_citations(table_facts)) if citations else []
 
-        # Step 4: Generate response with selected model
-        if model_type == "gemini":
-            if stream:
-                yield from generate_with_gemini(prompt_text, stream=True)
-            else:
-                return generate_with_gemini(prompt_text, stream=False)
-        else:  # ollama
-            if stream:
-                yield from generate_with_ollama(prompt_text, stream=True)
-            else:
-                return generate_with_ollama(prompt_text, stream=False)
+        # Widen matched children to their section or neighbors
+        if expand and results:
+            results = expand_hits(results, mode=expand)
+
+        if not results and not table_facts:
+            yield "No relevant information found. Please try a different search type or refine your question."
+            return
+
+        # Step 2 and 3: Format retrieved contexts into the prompt
+        with span("pack", documents=len(results)) as s:
+            prompt_text = build_rag_prompt(query, results, table_facts)
+            s.set("prompt_chars", len(prompt_text))
+
+        # Step 4: Generate response with the backend chosen by the pool
+        chunks = get_backend_pool().stream(prompt_text, query, model_type)
+        yield from _timed_stream(chunks, model_type)
+
+        if citations:
+            yield {"citations": cited}
 
     except Exception as e:
-        error_message = f"Error in RAG process: {str(e)}"
-        if stream:
-            yield error_message
+        yield f"Error in RAG process: {str(e)}"
+
+
+def generate_rag_response(
+    query,
+    search_type="hybrid",
+    top_k=5,
+    model_type="auto",
+    stream=False,
+    rerank=False,
+    rerank_candidates=20,
+    rerank_budget_ms=300,
+    filters=None,
+    use_tables=True,
+    expand=None,
+    citations=False,
+    table_fast_path=False,
+):
+    """
+    Generate RAG response using retrieved chunks.
+
+    Args:
+        query: User query
+        search_type: Type of search (keyword, semantic, hybrid)
+        top_k: Number of chunks to put into the prompt
+        model_type: "auto" to route by question and backend latency, a
+            provider (gemini, ollama) or a GENERATION_BACKENDS name
+        stream: Whether to stream the response
+        rerank: Whether to rerank first-stage candidates with a cross-encoder
+        rerank_candidates: Number of first-stage candidates when reranking
+        rerank_budget_ms: Skip reranking if it is estimated to take longer
+        filters: Metadata filters (content_types, filenames, page_range,
+            fiscal_year) applied before retrieval
+        use_tables: Ground the prompt of numeric questions with matching
+            facts from the table store
+        table_fast_path: Answer a numeric question about a named year from
+            the table store, skipping retrieval and the LLM, when exactly
+            one table row matches and its scale is known
+        expand: Expand matched child chunks to their "parent" section or
+            their "neighbors" before building the prompt
+        citations: Also return the sources (doc_id, page_number, filename,
+            content_type, snippet) the answer was based on
+
+    Returns:
+        Generated response or generator for streaming. With citations, the
+        response is {"answer": ..., "citations": [...]}, and a stream ends
+        with a {"citations": [...]} dict after the text chunks.
+    """
+    chunks = _rag_stream(
+        query, search_type, top_k, model_type, rerank, rerank_candidates,
+        rerank_budget_ms, filters, use_tables, table_fast_path, expand, citations,
+    )
+    if stream:
+        return chunks
+
+    answer, cited = [], []
+    for chunk in chunks:
+        if isinstance(chunk, dict):
+            cited = chunk["citations"]
         else:
-            return error_message
+            answer.append(chunk)
+    if citations:
+        return {"answer": "".join(answer), "citations": cited}
+    return "".join(answer)
 
 
 # For testing
@@ -226,7 +768,7 @@ if __name__ == "__main__":
 
     # Test streaming
     print("Response: ", end="", flush=True)
-    for chunk in generate_rag_response(query, "semantic", 20, "gemini", True):
+    for chunk in generate_rag_response(query, "semantic", 5, "gemini", True, rerank=True):
         print(chunk, end="", flush=True)
 
     # Generating streaming response with Ollama
@@ -1,8 +1,15 @@
-from opensearchpy import OpenSearch
-import requests
 import json
+import threading
+
+# Clients are created on first use and shared, so importing this module stays
+# cheap and each query does not pay for a new connection and ping.
+_opensearch_clients = {}
+_gemini_client = None
+_client_lock = threading.Lock()
 
 def get_embedding(prompt,model="nomic-embed-text"):
+    import requests
+
     url = "http://localhost:11434/api/embeddings/"
     headers = {"Content-Type": "application/json"}
     data = {"prompt": prompt, "model": model}
@@ -17,7 +24,34 @@ def get_embedding(prompt,model="nomic-embed-text"):
         )
 
 
+def get_embeddings(prompts, model="nomic-embed-text"):
+    """Embed several texts with a single batched Ollama request."""
+    import requests
+
+    url = "http://localhost:11434/api/embed"
+    headers = {"Content-Type": "application/json"}
+    data = {"input": list(prompts), "model": model}
+
+    response = requests.post(url, headers=headers, json=data)
+
+    if response.status_code == 200:
+        return response.json().get("embeddings", [])
+    else:
+        raise Exception(
+            f"Error fetching embeddings: {response.status_code}, {response.text}"
+        )
+
+
 def get_opensearch_client(host, port):
+    with _client_lock:
+        if (host, port) not in _opensearch_clients:
+            _opensearch_clients[(host, port)] = _connect_opensearch(host, port)
+        return _opensearch_clients[(host, port)]
+
+
+def _connect_opensearch(host, port):
+    from opensearchpy import OpenSearch
+
     client = OpenSearch(
         hosts=[{"host": host, "port": port}],
         http_compress=True,
@@ -36,6 +70,29 @@ def get_opensearch_client(host, port):
         raise ConnectionError("Failed to connect to OpenSearch.")
     return client
 
+def get_gemini_client():
+    """Create the Gemini client on first use."""
+    global _gemini_client
+    with _client_lock:
+        if _gemini_client is None:
+            from google import genai
+
+            # The client gets the API key from the environment variable `GEMINI_API_KEY`.
+            # Requests time out like the Ollama ones (in milliseconds), so a
+            # stalled call does not hang its thread indefinitely.
+            _gemini_client = genai.Client(http_options={"timeout": 120_000})
+        return _gemini_client
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    import math
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
 def load_chunks_from_cache_file(json_path: str):
     import os
     import json
@@ -0,0 +1,447 @@
+import math
+import os
+import time
+
+# k-NN index profiles. Each profile describes how the `embedding` field is
+# stored: the engine, the HNSW graph parameters and how vectors are encoded.
+# "default" reproduces the original bare knn_vector mapping.
+INDEX_PROFILES = {
+    "default": {
+        "engine": None,
+        "space_type": "cosinesimil",
+        "encoding": "float32",
+    },
+    "nmslib_hnsw": {
+        "engine": "nmslib",
+        "space_type": "cosinesimil",
+        "encoding": "float32",
+        "m": 16,
+        "ef_construction": 256,
+        "ef_search": 100,
+    },
+    "lucene_hnsw": {
+        "engine": "lucene",
+        "space_type": "cosinesimil",
+        "encoding": "float32",
+        "m": 16,
+        "ef_construction": 256,
+    },
+    "lucene_byte": {
+        "engine": "lucene",
+        "space_type": "cosinesimil",
+        "encoding": "byte",
+        "m": 16,
+        "ef_construction": 256,
+    },
+    "faiss_hnsw": {
+        "engine": "faiss",
+        "space_type": "innerproduct",
+        "encoding": "float32",
+        "m": 16,
+        "ef_construction": 256,
+        "ef_search": 100,
+    },
+    "faiss_hnsw_fp16": {
+        "engine": "faiss",
+        "space_type": "innerproduct",
+        "encoding": "fp16",
+        "m": 16,
+        "ef_construction": 256,
+        "ef_search": 100,
+    },
+    "faiss_hnsw_pq": {
+        "engine": "faiss",
+        "space_type": "innerproduct",
+        "encoding": "pq",
+        "m": 16,
+        "ef_construction": 256,
+        "ef_search": 100,
+        "pq_m": 64,  # number of sub-vectors, must divide the dimension
+        "pq_code_size": 8,  # bits per sub-vector code
+        "model_id": "localrag-hnsw-pq",
+    },
+}
+
+# Bytes used per vector component for each encoding
+BYTES_PER_DIMENSION = {"float32": 4, "fp16": 2, "byte": 1}
+
+# Profile the index is built and searched with. Ingestion and every search
+# default to it, so query vectors are encoded like the indexed ones, e.g.
+#   LOCALRAG_INDEX_PROFILE=lucene_byte
+active_index_profile = os.getenv("LOCALRAG_INDEX_PROFILE", "default")
+
+
+def get_index_profile(profile_name=None):
+    """Return the profile definition, the active one by default, or raise a helpful error."""
+    profile_name = profile_name or active_index_profile
+    if profile_name not in INDEX_PROFILES:
+        raise ValueError(
+            f"Unknown index profile '{profile_name}'. "
+            f"Available profiles: {', '.join(INDEX_PROFILES)}"
+        )
+    return INDEX_PROFILES[profile_name]
+
+
+def pq_model_id(profile_name, field="embedding"):
+    """Id of the trained PQ model of a vector field, every field needs its own."""
+    model_id = get_index_profile(profile_name)["model_id"]
+    if field == "embedding":
+        return model_id
+    return f"{model_id}-{field.replace('_', '-')}"
+
+
+def build_knn_field_mapping(profile_name, dimension, field="embedding"):
+    """
+    Build the `knn_vector` field mapping for a profile.
+
+    Args:
+        profile_name: Name of the profile in INDEX_PROFILES
+        dimension: Embedding dimension
+        field: Name of the vector field, selects the PQ model
+
+    Returns:
+        dict: Field mapping for the embedding field
+    """
+    profile = get_index_profile(profile_name)
+
+    if profile["engine"] is None:
+        return {"type": "knn_vector", "dimension": dimension}
+
+    # PQ needs a trained model which already carries the method definition
+    if profile["encoding"] == "pq":
+        return {"type": "knn_vector", "model_id": pq_model_id(profile_name, field)}
+
+    parameters = {
+        "m": profile["m"],
+        "ef_construction": profile["ef_construction"],
+    }
+    if profile["encoding"] == "fp16":
+        parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+
+    field = {
+        "type": "knn_vector",
+        "dimension": dimension,
+        "method": {
+            "name": "hnsw",
+            "engine": profile["engine"],
+            "space_type": profile["space_type"],
+            "parameters": parameters,
+        },
+    }
+    if profile["encoding"] == "byte":
+        field["data_type"] = "byte"
+    return field
+
+
+def build_index_settings(profile_name):
+    """Index-level k-NN settings for a profile."""
+    profile = get_index_profile(profile_name)
+    settings = {"knn": True}
+    if profile["engine"] is None:
+        settings["knn.space_type"] = profile["space_type"]
+    if "ef_search" in profile:
+        settings["knn.algo_param.ef_search"] = profile["ef_search"]
+    return settings
+
+
+def encode_vector(vector, profile_name):
+    """
+    Convert a float embedding into the representation a profile expects.
+
+    Inner product profiles get unit-length vectors so that scores match
+    cosine similarity, byte profiles get L2-normalized vectors scaled to
+    the signed 8-bit range. The same encoding must be applied to documents
+    and queries.
+    """
+    profile = get_index_profile(profile_name)
+    if profile["space_type"] != "innerproduct" and profile["encoding"] != "byte":
+        return vector
+
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    normalized = [v / norm for v in vector]
+    if profile["encoding"] != "byte":
+        return normalized
+    return [max(-128, min(127, round(v * 127))) for v in normalized]
+
+
+def get_pq_model_state(client, model_id):
+    """State of a trained model ("training", "created" or "failed"), None if missing."""
+    from opensearchpy.exceptions import NotFoundError
+
+    try:
+        model = client.transport.perform_request("GET", f"/_plugins/_knn/models/{model_id}")
+    except NotFoundError:
+        return None
+    return model.get("state")
+
+
+def train_pq_model(
+    client,
+    profile_name,
+    training_index,
+    dimension,
+    training_field="embedding",
+    field="embedding",
+    retrain=False,
+    timeout_s=600,
+    poll_interval_s=2,
+):
+    """
+    Train the product quantization model used by a PQ profile.
+
+    Training runs asynchronously in OpenSearch, so this waits until the
+    model is "created" before an index can refer to it. An existing model
+    is reused unless `retrain` is set or its training failed.
+
+    Args:
+        client: OpenSearch client instance
+        profile_name: Name of a profile with encoding "pq"
+        training_index: Index whose `training_field` holds training vectors,
+            encoded with encode_vector for the profile
+        dimension: Embedding dimension
+        training_field: Vector field to train on
+        field: Vector field the model is used for, see pq_model_id
+        retrain: Delete and retrain an existing model
+        timeout_s: Maximum time to wait for the training
+        poll_interval_s: Time between state checks
+
+    Returns:
+        str: Id of the created model
+    """
+    profile = get_index_profile(profile_name)
+    model_id = pq_model_id(profile_name, field)
+
+    state = get_pq_model_state(client, model_id)
+    if state == "created" and not retrain:
+        print(f"Reusing trained PQ model '{model_id}'")
+        return model_id
+    if state is not None and state != "training":
+        print(f"Deleting PQ model '{model_id}' ({state}) before training")
+        client.transport.perform_request("DELETE", f"/_plugins/_knn/models/{model_id}")
+        state = None
+
+    body = {
+        "training_index": training_index,
+        "training_field": training_field,
+        "dimension": dimension,
+        "method": {
+            "name": "hnsw",
+            "engine": "faiss",
+            "space_type": profile["space_type"],
+            "parameters": {
+                "m": profile["m"],
+                "ef_construction": profile["ef_construction"],
+                "encoder": {
+                    "name": "pq",
+                    "parameters": {
+                        "m": profile["pq_m"],
+                        "code_size": profile["pq_code_size"],
+                    },
+                },
+            },
+        },
+    }
+    if state is None:
+        print(f"Training PQ model '{model_id}' from '{training_index}'...")
+        client.transport.perform_request(
+            "POST", f"/_plugins/_knn/models/{model_id}/_train", body=body
+        )
+
+    deadline = time.monotonic() + timeout_s
+    while True:
+        state = get_pq_model_state(client, model_id)
+        if state == "created":
+            print(f"PQ model '{model_id}' is ready")
+            return model_id
+        if state == "failed":
+            raise RuntimeError(f"Training of PQ model '{model_id}' failed")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"PQ model '{model_id}' not trained after {timeout_s}s")
+        time.sleep(poll_interval_s)
+
+
+def train_pq_model_from_vectors(client, profile_name, vectors, field="embedding"):
+    """
+    Train a field's PQ model from vectors through a temporary staging index.
+
+    Args:
+        client: OpenSearch client instance
+        profile_name: Name of a profile with encoding "pq"
+        vectors: Vectors already encoded with encode_vector for the profile
+        field: Vector field the model is used for, see pq_model_id
+
+    Returns:
+        str: Id of the created model
+    """
+    from opensearchpy import helpers
+
+    training_index = f"{pq_model_id(profile_name, field)}-train"
+    if client.indices.exists(index=training_index):
+        client.indices.delete(index=training_index)
+    client.indices.create(
+        index=training_index,
+        body={
+            "settings": {"index": {"knn": True}},
+            "mappings": {
+                "properties": {"embedding": {"type": "knn_vector", "dimension": len(vectors[0])}}
+            },
+        },
+    )
+    try:
+        operations = [
+            {"_index": training_index, "_source": {"embedding": vector}} for vector in vectors
+        ]
+        helpers.bulk(client, operations, chunk_size=100, refresh=True)
+        return train_pq_model(client, profile_name, training_index, len(vectors[0]), field=field)
+    finally:
+        # The trained model no longer needs the training vectors
+        client.indices.delete(index=training_index)
+
+
+def estimate_memory_bytes(profile_name, dimension, num_vectors, num_segments=1):
+    """
+    Estimate native memory needed by the HNSW graph of a profile.
+
+    Uses the sizing formulas from the OpenSearch k-NN documentation.
+
+    Args:
+        profile_name: Name of the profile
+        dimension: Embedding dimension
+        num_vectors: Number of indexed vectors
+        num_segments: Number of segments (only used for PQ code books)
+
+    Returns:
+        int: Estimated bytes
+    """
+    profile = get_index_profile(profile_name)
+    m = profile.get("m", 16)
+
+    if profile["encoding"] == "pq":
+        code_bytes = profile["pq_code_size"] / 8 * profile["pq_m"]
+        per_vector = code_bytes + 24 + 8 * m
+        code_books = num_segments * (2 ** profile["pq_code_size"]) * 4 * dimension
+        return int(1.1 * (per_vector * num_vectors + code_books))
+
+    bytes_per_dimension = BYTES_PER_DIMENSION[profile["encoding"]]
+    return int(1.1 * (bytes_per_dimension * dimension + 8 * m) * num_vectors)
+
+
+def exact_top_k(query_vector, vectors, k):
+    """Brute-force cosine similarity top-k over float vectors (positions)."""
+    query_norm = math.sqrt(sum(v * v for v in query_vector)) or 1.0
+    scores = []
+    for position, vector in enumerate(vectors):
+        dot = sum(a * b for a, b in zip(query_vector, vector))
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        scores.append((dot / (query_norm * norm), position))
+    scores.sort(reverse=True)
+    return [position for _, position in scores[:k]]
+
+
+def evaluate_index_profile(client, profile_name, prepared_chunks, queries, k=10):
+    """
+    Build an index for a profile and measure recall@k against exact search.
+
+    The baseline is computed in Python over the original float32 embeddings,
+    so quantization and HNSW approximation errors are both reflected. The
+    index is deleted afterwards, so evaluating every profile does not leave
+    all their vectors in the node's memory.
+
+    Args:
+        client: OpenSearch client instance
+        profile_name: Name of the profile to evaluate
+        prepared_chunks: Output of ingestion.prepare_chunks_for_ingestion
+            with the "default" profile (float embeddings)
+        queries: List of query strings
+        k: Cut-off for recall
+
+    Returns:
+        dict: Profile name, estimated memory and recall@k
+    """
+    from opensearchpy import helpers
+
+    from embedding_models import active_embedding_model, embedding_field
+    from helper import get_embedding
+    from ingestion import create_index_if_not_exists
+
+    index_name = f"localrag_profile_{profile_name}"
+    field = embedding_field(active_embedding_model)
+    vectors = [chunk[field] for chunk in prepared_chunks]
+    dimension = len(vectors[0])
+
+    profile = get_index_profile(profile_name)
+    if profile["encoding"] == "pq":
+        # Train on vectors encoded like the ones indexed below
+        train_pq_model_from_vectors(
+            client, profile_name, [encode_vector(v, profile_name) for v in vectors], field
+        )
+
+    create_index_if_not_exists(
+        client, index_name, index_profile=profile_name, embedding_models=[active_embedding_model]
+    )
+    try:
+        operations = [
+            {
+                "_index": index_name,
+                "_id": str(position),
+                "_source": {
+                    **chunk,
+                    field: encode_vector(chunk[field], profile_name),
+                },
+            }
+            for position, chunk in enumerate(prepared_chunks)
+        ]
+        helpers.bulk(client, operations, chunk_size=100, refresh=True)
+
+        recalls = []
+        for query in queries:
+            query_embedding = get_embedding(query, active_embedding_model)
+            expected = set(exact_top_k(query_embedding, vectors, k))
+            search_query = {
+                "size": k,
+                "query": {
+                    "knn": {
+                        field: {
+                            "vector": encode_vector(query_embedding, profile_name),
+                            "k": k,
+                        }
+                    }
+                },
+                "_source": False,
+            }
+            response = client.search(index=index_name, body=search_query)
+            found = {int(hit["_id"]) for hit in response["hits"]["hits"]}
+            recalls.append(len(found & expected) / len(expected))
+    finally:
+        client.indices.delete(index=index_name)
+
+    return {
+        "profile": profile_name,
+        "memory_bytes": estimate_memory_bytes(profile_name, dimension, len(vectors)),
+        f"recall@{k}": sum(recalls) / len(recalls),
+    }
+
+
+if __name__ == "__main__":
+    from helper import get_opensearch_client, load_chunks_from_cache_file
+    from ingestion import json_output_text_chunks_path, prepare_chunks_for_ingestion
+
+    queries = [
+        "What is net profit of Accenture?",
+        "How much cash flow did Accenture generate?",
+        "What were the new bookings in fiscal 2023?",
+        "Who is the chief executive officer?",
+        "How many people does Accenture employ?",
+    ]
+
+    text_chunks = load_chunks_from_cache_file(json_output_text_chunks_path)
+    # Float embeddings, each profile encodes them itself
+    prepared_chunks = prepare_chunks_for_ingestion(text_chunks, index_profile="default")
+    client = get_opensearch_client("localhost", 9200)
+
+    for profile_name in INDEX_PROFILES:
+        result = evaluate_index_profile(client, profile_name, prepared_chunks, queries)
+        print(
+            f"{profile_name:>16}: {result['memory_bytes'] / 1024 / 1024:8.2f} MiB, "
+            f"recall@10 = {result['recall@10']:.3f}"
+        )
@@ -2,14 +2,49 @@ json_output_text_chunks_path = "text_chunks.json"
 json_output_image_chunks_path = "image_chunks.json"
 json_output_table_chunks_path = "table_chunks.json"
 
-def create_index_if_not_exists(client, index_name):
+
+def infer_fiscal_year(filename):
+    """Guess the fiscal year from a report filename such as 'Annual-Report-2023.pdf'."""
+    import re
+
+    match = re.search(r"(?:19|20)\d{2}", filename or "")
+    return int(match.group()) if match else None
+
+def create_index_if_not_exists(client, index_name, index_profile=None, embedding_models=None):
     """
     Create an OpenSearch index with proper mapping for vector search if it doesn't exist.
 
     Args:
         client: OpenSearch client instance
         index_name: Name of the index to create
+        index_profile: k-NN profile from index_profiles.INDEX_PROFILES, by
+            default LOCALRAG_INDEX_PROFILE
+        embedding_models: Models that get a vector field, by default the
+            active and shadow models (see embedding_models.py)
     """
+    from embedding_models import embedding_dimension, embedding_field, ingestion_models
+    from index_profiles import (
+        active_index_profile,
+        build_index_settings,
+        build_knn_field_mapping,
+        get_index_profile,
+        get_pq_model_state,
+        pq_model_id,
+    )
+
+    index_profile = index_profile or active_index_profile
+    models = embedding_models or ingestion_models()
+
+    # PQ fields refer to trained models, check them before the old index is gone
+    if get_index_profile(index_profile)["encoding"] == "pq":
+        for model in models:
+            model_id = pq_model_id(index_profile, embedding_field(model))
+            if get_pq_model_state(client, model_id) != "created":
+                raise ValueError(
+                    f"PQ model '{model_id}' for '{model}' is not trained. Train it with "
+                    "index_profiles.train_pq_model_from_vectors before creating the index."
+                )
+
     # Delete the index if it exists (to ensure proper mapping)
     if client.indices.exists(index=index_name):
         print(
@@ -17,12 +52,14 @@ def create_index_if_not_exists(client, index_name):
         )
         client.indices.delete(index=index_name)
 
-    # Get dimension from a sample embedding
-    from helper import get_embedding
-
-    sample_embedding = get_embedding("Sample text for dimension detection")
-    dimension = len(sample_embedding)
-    print(f"Using embedding dimension: {dimension}")
+    # One vector field per embedding model, sized from a sample embedding
+    vector_fields = {}
+    for model in models:
+        dimension = embedding_dimension(model)
+        print(f"Using embedding dimension {dimension} for '{model}'")
+        field = embedding_field(model)
+        vector_fields[field] = build_knn_field_mapping(index_profile, dimension, field)
+    print(f"Using index profile: {index_profile}")
 
     # Define mappings with vector field for embeddings
     mappings = {
@@ -30,8 +67,15 @@ def create_index_if_not_exists(client, index_name):
             "properties": {
                 "content": {"type": "text"},
                 "content_type": {"type": "keyword"},
-                "embedding": {"type": "knn_vector", "dimension": dimension},
-                "base64_image": {"type": "binary", "doc_values": False, "index": False},
+                "chunk_id": {"type": "keyword"},
+                "parent_id": {"type": "keyword"},
+                "prev_id": {"type": "keyword", "index": False},
+                "next_id": {"type": "keyword", "index": False},
+                "page_number": {"type": "integer"},
+                "fiscal_year": {"type": "integer"},
+                **vector_fields,
+                # Digest of the image in the blob store, images are not indexed
+                "image_ref": {"type": "keyword", "index": False, "doc_values": False},
                 "table_html": {"type": "text", "index": False},
                 "metadata": {
                     "properties": {
@@ -42,12 +86,7 @@ def create_index_if_not_exists(client, index_name):
                 },
             }
         },
-        "settings": {
-            "index": {
-                "knn": True,
-                "knn.space_type": "cosinesimil",  # Use cosine similarity for embeddings
-            }
-        },
+        "settings": {"index": build_index_settings(index_profile)},
     }
 
     try:
@@ -57,19 +96,60 @@ def create_index_if_not_exists(client, index_name):
         print(f"Error creating index: {e}")
         raise
 
-def prepare_chunks_for_ingestion(chunks):
+def create_parent_index_if_not_exists(client, index_name):
+    """
+    Create the index holding parent sections of child chunks.
+
+    Parents are only fetched by id to expand matched children, so nothing
+    in them is embedded and their content is not searchable.
+
+    Args:
+        client: OpenSearch client instance
+        index_name: Name of the child index, parents go to "<index_name>_parents"
+    """
+    parent_index_name = f"{index_name}_parents"
+    if client.indices.exists(index=parent_index_name):
+        client.indices.delete(index=parent_index_name)
+
+    mappings = {
+        "mappings": {
+            "properties": {
+                "content": {"type": "text", "index": False},
+                "page_number": {"type": "integer"},
+                "metadata": {"properties": {"filename": {"type": "keyword"}}},
+            }
+        }
+    }
+    client.indices.create(index=parent_index_name, body=mappings)
+    print(f"Created parent index '{parent_index_name}'.")
+    return parent_index_name
+
+def prepare_chunks_for_ingestion(
+    chunks, index_profile=None, fiscal_year=None, embedding_models=None
+):
     """
     Prepare chunks for ingestion by adding embeddings and token counts.
 
     Args:
         chunks: List of chunks to prepare
+        index_profile: k-NN profile the embeddings are encoded for, by
+            default LOCALRAG_INDEX_PROFILE
+        fiscal_year: Fiscal year of the report, inferred from the filename
+            when not given
+        embedding_models: Models to embed with, each into its own field. By
+            default the active model, plus the shadow model during a migration
 
     Returns:
         List of prepared chunks ready for ingestion
     """
+    from blob_store import put_base64_image
+    from embedding_models import embedding_field, ingestion_models
     from helper import get_embedding
+    from index_profiles import encode_vector
     from tqdm import tqdm
+    from tracing import span
 
+    models = embedding_models or ingestion_models()
     prepared_chunks = []
 
     for i, chunk in tqdm(enumerate(chunks)):
@@ -78,24 +158,49 @@ def prepare_chunks_for_ingestion(chunks):
             if not chunk.get("content"):
                 continue
 
-            # Compute embedding
-            embedding = get_embedding(chunk["content"])
+            # Compute embeddings, dual-writing every configured model
+            embeddings = {}
+            for model in models:
+                content_type = chunk.get("content_type", "text")
+                with span("embed", content_type=content_type, model=model):
+                    embeddings[embedding_field(model)] = encode_vector(
+                        get_embedding(chunk["content"], model), index_profile
+                    )
+
+            # Text chunks use "filename", table and image chunks "file_name"
+            filename = chunk.get("filename") or chunk.get("file_name", "")
+
+            # Image chunks carry a MIME type, filters work on the plain type
+            content_type = chunk.get("content_type", "text")
+            if content_type.startswith("image"):
+                content_type = "image"
 
             # Create document for ingestion
             ingestion_doc = {
                 "content": chunk["content"],
-                "content_type": chunk.get("content_type", "text"),
-                "embedding": embedding,
+                "content_type": content_type,
+                **embeddings,
+                "page_number": int(chunk["page_number"]) if chunk.get("page_number") else None,
+                "fiscal_year": chunk.get("fiscal_year") or fiscal_year or infer_fiscal_year(filename),
                 "metadata": {
-                    "filename": chunk.get("filename", ""),
+                    "filename": filename,
                     "caption": chunk.get("caption", ""),
                     "image_text": chunk.get("image_text", ""),
                 },
             }
 
-            # Add image-specific data if available
-            if chunk.get("content_type") == "image" and "base64_image" in chunk:
-                ingestion_doc["base64_image"] = chunk["base64_image"]
+            # Link child chunks to their parent section and neighbors
+            for key in ("chunk_id", "parent_id", "prev_id", "next_id"):
+                if chunk.get(key):
+                    ingestion_doc[key] = chunk[key]
+
+            # Add image reference if available, moving legacy inline images
+            # to the blob store so only the digest is indexed
+            if content_type == "image":
+                if "image_ref" in chunk:
+                    ingestion_doc["image_ref"] = chunk["image_ref"]
+                elif chunk.get("image_base64"):
+                    ingestion_doc["image_ref"] = put_base64_image(chunk["image_base64"])
 
             # Add table-specific data if available
             if chunk.get("content_type") == "table" and "table_as_html" in chunk:
@@ -131,16 +236,22 @@ def ingest_chunks_into_opensearch(client, index_name, chunks):
 
     # Use bulk API for better performance
     from opensearchpy import helpers
+    from tracing import span
 
     # Prepare bulk operations
     operations = []
     for i, chunk in enumerate(chunks):
-        operations.append({'_index': index_name, '_source': chunk})
+        operation = {'_index': index_name, '_source': chunk}
+        # Child chunks use stable ids so neighbors can be fetched by id
+        if chunk.get("chunk_id"):
+            operation['_id'] = chunk["chunk_id"]
+        operations.append(operation)
 
         # Process in batches of 100
         if (i + 1) % 100 == 0 or i == len(chunks) - 1:
             try:
-                success, failed_items = helpers.bulk(client, operations, stats_only=True)
+                with span("bulk_index", documents=len(operations)):
+                    success, failed_items = helpers.bulk(client, operations, stats_only=True)
                 successful += success
                 failed += len(operations) - success
                 operations = []  # Reset for next batch
@@ -164,12 +275,62 @@ def ingest_chunks_into_opensearch(client, index_name, chunks):
     return successful
 
 
-def ingest_all_content_into_opensearch(image_chunks = None, table_chunks = None, text_chunks = None, index_name = "localrag"):
+def ingest_parent_sections(client, index_name, parents):
+    """
+    Store parent sections under their parent_id in the parent index.
+
+    Args:
+        client: OpenSearch client instance
+        index_name: Name of the child index
+        parents: Parent sections from chunking.build_hierarchical_chunks
+    """
+    from opensearchpy import helpers
+
+    operations = [
+        {
+            '_index': f"{index_name}_parents",
+            '_id': parent["parent_id"],
+            '_source': {
+                "content": parent["content"],
+                "page_number": int(parent["page_number"]) if parent.get("page_number") else None,
+                "metadata": {"filename": parent.get("filename", "")},
+            },
+        }
+        for parent in parents
+    ]
+    success, _ = helpers.bulk(client, operations, chunk_size=100, stats_only=True)
+    print(f"Ingested {success} parent sections")
+    return success
+
+
+def ingest_all_content_into_opensearch(image_chunks = None, table_chunks = None, text_chunks = None, index_name = "localrag", index_profile = None, parent_sections = None, embedding_models = None):
     from helper import get_opensearch_client
 
     client = get_opensearch_client("localhost", 9200)
 
-    create_index_if_not_exists(client, index_name)
+    # A PQ profile needs a model per vector field, trained on the chunks' encoded vectors
+    from embedding_models import embedding_field, ingestion_models
+    from index_profiles import (
+        active_index_profile,
+        get_index_profile,
+        get_pq_model_state,
+        pq_model_id,
+        train_pq_model_from_vectors,
+    )
+
+    index_profile = index_profile or active_index_profile
+    if get_index_profile(index_profile)["encoding"] == "pq":
+        all_chunks = (image_chunks or []) + (table_chunks or []) + (text_chunks or [])
+        for model in embedding_models or ingestion_models():
+            field = embedding_field(model)
+            if get_pq_model_state(client, pq_model_id(index_profile, field)) != "created":
+                vectors = [chunk[field] for chunk in all_chunks if field in chunk]
+                train_pq_model_from_vectors(client, index_profile, vectors, field)
+
+    create_index_if_not_exists(client, index_name, index_profile, embedding_models)
+    if parent_sections:
+        create_parent_index_if_not_exists(client, index_name)
+        ingest_parent_sections(client, index_name, parent_sections)
     if image_chunks:
         ingest_chunks_into_opensearch(
             client = client, 
@@ -187,19 +348,33 @@ def ingest_all_content_into_opensearch(image_chunks = None, table_chunks = None,
 
 if __name__ == "__main__":
     from helper import *
+    # sample.pdf is the Accenture fiscal 2023 annual report
     processed_image_chunks = load_chunks_from_cache_file(json_output_image_chunks_path)
-    image_chunks = prepare_chunks_for_ingestion(processed_image_chunks)
+    image_chunks = prepare_chunks_for_ingestion(processed_image_chunks, fiscal_year=2023)
 
     processed_table_chunks = load_chunks_from_cache_file(json_output_table_chunks_path)
-    table_chunks = prepare_chunks_for_ingestion(processed_table_chunks)
+    table_chunks = prepare_chunks_for_ingestion(processed_table_chunks, fiscal_year=2023)
+
+    # Columnar table store for the numeric fast path
+    # (scale headers such as "In thousands" come from the text of the same page)
+    from table_store import build_table_store, save_table_store
 
     processed_text_chunks = load_chunks_from_cache_file(json_output_text_chunks_path)
-    text_chunks = prepare_chunks_for_ingestion(processed_text_chunks)
+    save_table_store(
+        build_table_store(processed_table_chunks, processed_text_chunks, fiscal_year=2023)
+    )
+
+    # Small child chunks are embedded, their sections are stored as parents
+    from chunking import build_hierarchical_chunks
+
+    parent_sections, child_chunks = build_hierarchical_chunks(processed_text_chunks)
+    text_chunks = prepare_chunks_for_ingestion(child_chunks, fiscal_year=2023)
     ingest_all_content_into_opensearch(
         text_chunks = text_chunks,
         image_chunks = image_chunks,
         table_chunks = table_chunks,
-        index_name="localrag")
+        index_name="localrag",
+        parent_sections = parent_sections)
 
 
 
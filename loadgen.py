@@ -0,0 +1,199 @@
+import http.client
+import json
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from benchmark import BENCHMARK_QUESTIONS
+from helper import percentile
+
+
+def _post(connection, path, body):
+    payload = json.dumps(body).encode("utf-8")
+    connection.request(
+        "POST", path, body=payload, headers={"Content-Type": "application/json"}
+    )
+    return connection.getresponse()
+
+
+def _read_stream(response, started):
+    """Read an SSE answer, returning the time to the first token event."""
+    first_token_s = None
+    while True:
+        line = response.readline()
+        if not line:
+            break
+        if first_token_s is None and line.startswith(b"event: token"):
+            first_token_s = time.perf_counter() - started
+        if line.startswith(b"event: done") or line.startswith(b"event: error"):
+            # Drain the data line, blank line and the terminating chunk
+            response.read()
+            break
+    return first_token_s
+
+
+def _worker(
+    url, endpoint, body_for, stream, deadline, max_requests, counter, results, lock
+):
+    # One persistent connection per worker, reopened only after errors
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=300)
+    while time.perf_counter() < deadline:
+        with lock:
+            if counter["sent"] >= max_requests:
+                break
+            index = counter["sent"]
+            counter["sent"] += 1
+
+        body = body_for(index)
+        started = time.perf_counter()
+        first_token_s = None
+        item_errors = 0
+        try:
+            response = _post(connection, f"/{endpoint}", body)
+            status = response.status
+            if stream and status == 200:
+                first_token_s = _read_stream(response, started)
+            else:
+                data = response.read()
+                if status == 200 and "queries" in body:
+                    # Batch items shed by the server come back inside a 200
+                    items = json.loads(data)["results"]
+                    item_errors = sum(
+                        1 for item in items if isinstance(item, dict) and "error" in item
+                    )
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+            connection.close()
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=300)
+        latency_s = time.perf_counter() - started
+
+        with lock:
+            results.append(
+                {
+                    "status": status,
+                    "latency_s": latency_s,
+                    "first_token_s": first_token_s,
+                    "questions": len(body.get("queries", [body.get("query")])),
+                    "item_errors": item_errors,
+                }
+            )
+    connection.close()
+
+
+def run_load(
+    url="http://localhost:8000",
+    endpoint="answer",
+    concurrency=8,
+    requests=100,
+    duration_s=60,
+    stream=False,
+    batch_size=1,
+    search_type="hybrid",
+):
+    """
+    Replay the benchmark questions against the HTTP API.
+
+    All workers share the rate limit of this machine's address and every
+    question of a batch is charged, so raise LOCALRAG_RATE_LIMIT_PER_MINUTE
+    and LOCALRAG_RATE_LIMIT_BURST (at least `batch_size`) on the server to
+    measure throughput rather than the limit.
+
+    Args:
+        url: Base URL of api.py
+        endpoint: "search" or "answer"
+        concurrency: Number of workers, each with a keep-alive connection
+        requests: Stop after this many requests
+        duration_s: Or after this many seconds
+        stream: Request SSE answers and measure time to first token
+        batch_size: Questions per request, sent as a JSON batch when > 1
+        search_type: Search type of every request
+
+    Returns:
+        dict: Throughput, latency percentiles and status counts
+    """
+    questions = [item["question"] for item in BENCHMARK_QUESTIONS]
+
+    def body_for(index):
+        body = {"search_type": search_type}
+        if batch_size > 1:
+            body["queries"] = [
+                questions[(index * batch_size + i) % len(questions)] for i in range(batch_size)
+            ]
+        else:
+            body["query"] = questions[index % len(questions)]
+            body["stream"] = stream and endpoint == "answer"
+        return body
+
+    results, counter, lock = [], {"sent": 0}, threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration_s
+    workers = [
+        threading.Thread(
+            target=_worker,
+            args=(url, endpoint, body_for, stream, deadline, requests, counter, results, lock),
+        )
+        for _ in range(concurrency)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r["status"] == 200]
+    answered = sum(r["questions"] - r["item_errors"] for r in ok)
+    latencies = [r["latency_s"] * 1000 for r in ok]
+    ttfts = [r["first_token_s"] * 1000 for r in ok if r["first_token_s"] is not None]
+    summary = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "statuses": dict(Counter(str(r["status"]) for r in results)),
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "questions_per_s": answered / elapsed if elapsed else 0.0,
+        "item_errors": sum(r["item_errors"] for r in ok),
+    }
+    if latencies:
+        summary.update(
+            latency_ms_p50=percentile(latencies, 50),
+            latency_ms_p95=percentile(latencies, 95),
+            latency_ms_p99=percentile(latencies, 99),
+        )
+    if ttfts:
+        summary.update(
+            ttft_ms_p50=percentile(ttfts, 50),
+            ttft_ms_p95=percentile(ttfts, 95),
+            ttft_ms_p99=percentile(ttfts, 99),
+        )
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Local load generator for api.py")
+    arg_parser.add_argument("--url", default="http://localhost:8000")
+    arg_parser.add_argument("--endpoint", default="answer", choices=["search", "answer"])
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--requests", type=int, default=100)
+    arg_parser.add_argument("--duration", type=float, default=60, help="Maximum run time in seconds")
+    arg_parser.add_argument("--stream", action="store_true", help="Stream answers over SSE")
+    arg_parser.add_argument("--batch-size", type=int, default=1)
+    arg_parser.add_argument(
+        "--search-type", default="hybrid", choices=["keyword", "semantic", "hybrid"]
+    )
+    args = arg_parser.parse_args()
+
+    summary = run_load(
+        args.url,
+        args.endpoint,
+        args.concurrency,
+        args.requests,
+        args.duration,
+        args.stream,
+        args.batch_size,
+        args.search_type,
+    )
+    print(json.dumps(summary, indent=2))
@@ -6,6 +6,7 @@ from unstructured.partition.pdf import partition_pdf
 from unstructured.staging.base import elements_from_dicts
 from unstructured.chunking.title import chunk_by_title
 from dotenv import load_dotenv
+from tracing import span
 
 
 load_dotenv()
@@ -54,27 +55,29 @@ def load_elements_from_file(json_path: str):
 def parse_pdf_to_elements(pdf_path: str):
     """Parse the PDF using Unstructured into a list of elements."""
     print("[INFO] Parsing PDF...")
-    elements = partition_pdf(
-        filename=pdf_path,
-        strategy="hi_res",
-        extract_images_in_pdf=True,
-        extract_image_block_to_payload=True,
-        extract_image_block_types=["Image", "Table", "Figure"],
-        infer_table_structure=True,
-    )
+    with span("parse", strategy="hi_res"):
+        elements = partition_pdf(
+            filename=pdf_path,
+            strategy="hi_res",
+            extract_images_in_pdf=True,
+            extract_image_block_to_payload=True,
+            extract_image_block_types=["Image", "Table", "Figure"],
+            infer_table_structure=True,
+        )
     print(f"[INFO] Parsed {len(elements)} elements.")
     return elements
 
 # Parse PDF into text elements
 def parse_pdf_to_text_elements(pdf_path: str):
     print("Parsing PDF...")
-    elements = partition_pdf(
-        filename=pdf_path,
-        strategy="fast",
-        chunking_strategy="by_title",
-        split_pdf_page=True,
-        split_pdf_concurrency_level=15,
-    )
+    with span("parse", strategy="fast"):
+        elements = partition_pdf(
+            filename=pdf_path,
+            strategy="fast",
+            chunking_strategy="by_title",
+            split_pdf_page=True,
+            split_pdf_concurrency_level=15,
+        )
     return elements
 
 def get_parsed_text_elements():
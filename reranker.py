@@ -0,0 +1,180 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from tracing import incr, span
+
+# Directory with an exported cross-encoder (model.onnx + tokenizer.json), e.g.
+# cross-encoder/ms-marco-MiniLM-L-6-v2 exported with optimum.
+reranker_model_path = os.getenv("RERANKER_MODEL_PATH", "models/cross-encoder")
+
+# Cache of (query, passage) scores, oldest entries are evicted first
+score_cache_size = 10000
+_score_cache = OrderedDict()
+
+# Running estimate of the cost of scoring one pair, used for the latency budget
+_ms_per_pair = None
+_scorer = None
+# Requests rerank concurrently, the cache and the estimate are shared
+_lock = threading.Lock()
+_scorer_lock = threading.Lock()
+
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for",
+    "from", "how", "in", "is", "it", "of", "on", "or", "the", "to", "was",
+    "were", "what", "which", "who", "with",
+}
+
+
+def _tokenize(text):
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+
+def lexical_scores(query, passages):
+    """
+    Pure-Python stand-in for a cross-encoder.
+
+    Scores passages by BM25-style overlap with the query terms, computed
+    within the candidate set. Used when no ONNX model is available.
+    """
+    query_terms = set(_tokenize(query))
+    tokenized = [_tokenize(p) for p in passages]
+    avg_length = sum(len(t) for t in tokenized) / max(len(tokenized), 1) or 1.0
+    document_frequency = Counter(term for t in tokenized for term in set(t))
+
+    scores = []
+    for tokens in tokenized:
+        counts = Counter(tokens)
+        score = 0.0
+        for term in query_terms:
+            if not counts[term]:
+                continue
+            idf = math.log(1 + (len(passages) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            tf = counts[term] * 2.2 / (counts[term] + 1.2 * (0.25 + 0.75 * len(tokens) / avg_length))
+            score += idf * tf
+        scores.append(score)
+    return scores
+
+
+def load_onnx_cross_encoder(model_path):
+    """
+    Load an ONNX cross-encoder running on CPU.
+
+    Returns:
+        callable: Function scoring (query, passages) -> list of floats
+    """
+    import numpy as np
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+    tokenizer.enable_truncation(max_length=512)
+    tokenizer.enable_padding()
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(
+        os.path.join(model_path, "model.onnx"),
+        sess_options=options,
+        providers=["CPUExecutionProvider"],
+    )
+    input_names = {i.name for i in session.get_inputs()}
+
+    def score(query, passages):
+        encodings = tokenizer.encode_batch([(query, p) for p in passages])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        inputs = {name: value for name, value in inputs.items() if name in input_names}
+        logits = session.run(None, inputs)[0]
+        return [float(row[0]) for row in logits]
+
+    return score
+
+
+def get_scorer():
+    """Return the cross-encoder, falling back to the lexical stand-in."""
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            try:
+                _scorer = load_onnx_cross_encoder(reranker_model_path)
+                print(f"Loaded ONNX cross-encoder from '{reranker_model_path}'")
+            except Exception as e:
+                print(f"Cross-encoder unavailable ({e}), using lexical reranker")
+                _scorer = lexical_scores
+        return _scorer
+
+
+def _cache_key(query, passage):
+    return hashlib.sha1(f"{query}\x00{passage}".encode("utf-8")).hexdigest()
+
+
+def rerank(query, hits, top_k=5, batch_size=16, latency_budget_ms=None):
+    """
+    Re-order first-stage hits with a cross-encoder and keep the best top_k.
+
+    Args:
+        query (str): User query
+        hits (list): Search hits with `_source.content`
+        top_k (int): Number of hits to keep
+        batch_size (int): Number of pairs scored per inference call
+        latency_budget_ms (float): Skip reranking if the estimated scoring
+            time of the uncached pairs exceeds this budget
+
+    Returns:
+        list: Best top_k hits, each with a `_rerank_score`
+    """
+    global _ms_per_pair
+
+    passages = [hit["_source"].get("content", "") for hit in hits]
+    keys = [_cache_key(query, p) for p in passages]
+    # Scores are copied out, other requests may evict cache entries meanwhile
+    with _lock:
+        scores_by_key = {key: _score_cache[key] for key in keys if key in _score_cache}
+        ms_per_pair = _ms_per_pair
+    missing = [i for i, key in enumerate(keys) if key not in scores_by_key]
+    incr("rerank_cache_hit", len(keys) - len(missing))
+    incr("rerank_cache_miss", len(missing))
+
+    if missing and latency_budget_ms is not None and ms_per_pair is not None:
+        estimated_ms = len(missing) * ms_per_pair
+        if estimated_ms > latency_budget_ms:
+            print(
+                f"Skipping rerank: estimated {estimated_ms:.0f}ms exceeds "
+                f"budget of {latency_budget_ms:.0f}ms"
+            )
+            return hits[:top_k]
+
+    scorer = get_scorer()
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start : start + batch_size]
+        started = time.perf_counter()
+        with span("rerank", pairs=len(batch)):
+            scores = scorer(query, [passages[i] for i in batch])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        for i, score in zip(batch, scores):
+            scores_by_key[keys[i]] = score
+
+        # Exponentially weighted average keeps the estimate current
+        per_pair = elapsed_ms / len(batch)
+        with _lock:
+            _ms_per_pair = per_pair if _ms_per_pair is None else 0.8 * _ms_per_pair + 0.2 * per_pair
+
+    with _lock:
+        for hit, key in zip(hits, keys):
+            _score_cache[key] = scores_by_key[key]
+            _score_cache.move_to_end(key)
+            hit["_rerank_score"] = scores_by_key[key]
+        while len(_score_cache) > score_cache_size:
+            _score_cache.popitem(last=False)
+
+    return sorted(hits, key=lambda hit: hit["_rerank_score"], reverse=True)[:top_k]
@@ -1,13 +1,220 @@
-from helper import get_embedding, get_opensearch_client
+import os
+import time
 
+import embedding_models
+from embedding_models import embedding_field, run_shadow_search
+from helper import get_embedding, get_embeddings, get_opensearch_client
+from index_profiles import encode_vector, get_index_profile
+from tracing import span
 
-def keyword_search(query_text, top_k=20):
+# Filtered k-NN on engines without efficient filtering (nmslib, including the
+# "default" profile): "approximate" searches filtered_knn_candidates nearest
+# neighbors and then filters them, so selective filters may return fewer
+# hits. "exact" scores every document matching the filters with a script,
+# which scans the whole filtered set per query. Lucene and Faiss profiles
+# (LOCALRAG_INDEX_PROFILE) filter inside the graph search and need neither.
+filtered_knn_mode = os.getenv("LOCALRAG_FILTERED_KNN", "approximate")
+filtered_knn_candidates = int(os.getenv("LOCALRAG_FILTERED_KNN_CANDIDATES", "500"))
+
+SOURCE_FIELDS = [
+    "content", "content_type", "token_count", "image_ref", "page_number", "metadata.filename",
+    "chunk_id", "parent_id", "prev_id", "next_id",
+]
+
+# Enough to display citations without shipping the chunk text
+CITATION_SOURCE_FIELDS = [
+    "content_type", "page_number", "metadata.filename", "chunk_id", "parent_id", "image_ref",
+]
+
+
+def build_highlight(fragment_size=150, number_of_fragments=2):
+    """Highlight settings returning short `content` fragments around matches."""
+    return {
+        "pre_tags": ["**"],
+        "post_tags": ["**"],
+        "fields": {
+            "content": {
+                "fragment_size": fragment_size,
+                "number_of_fragments": number_of_fragments,
+            }
+        },
+    }
+
+
+def build_filter_clauses(filters):
+    """
+    Translate search filters into OpenSearch filter clauses.
+
+    Args:
+        filters (dict): Any of
+            content_types (list): e.g. ["table", "image"]
+            filenames (list): Source documents
+            page_range (tuple): Inclusive (first, last) page, either may be None
+            fiscal_year (int | list): Fiscal year(s) of the report
+
+    Returns:
+        list: Filter clauses, empty when nothing is filtered
+
+    Note:
+        The cached text chunks have no page numbers (they are indexed with
+        page_number None), so a page_range filter excludes all text until
+        the text cache is regenerated with chunking.create_semantic_chunks.
+    """
+    if not filters:
+        return []
+
+    clauses = []
+    if filters.get("content_types"):
+        clauses.append({"terms": {"content_type": list(filters["content_types"])}})
+    if filters.get("filenames"):
+        clauses.append({"terms": {"metadata.filename": list(filters["filenames"])}})
+    if filters.get("page_range"):
+        first, last = filters["page_range"]
+        page_range = {}
+        if first is not None:
+            page_range["gte"] = int(first)
+        if last is not None:
+            page_range["lte"] = int(last)
+        if page_range:
+            clauses.append({"range": {"page_number": page_range}})
+            if not filters.get("content_types") or "text" in filters["content_types"]:
+                print("[WARN] Text chunks have no page numbers, the page filter excludes all text")
+    if filters.get("fiscal_year"):
+        years = filters["fiscal_year"]
+        years = years if isinstance(years, (list, tuple)) else [years]
+        clauses.append({"terms": {"fiscal_year": [int(y) for y in years]}})
+    return clauses
+
+
+def build_knn_clause(
+    query_embedding, top_k, filter_clauses=None, index_profile=None, field="embedding"
+):
+    """
+    Build the vector part of a query, applying filters before the k-NN search.
+
+    Lucene and Faiss profiles use efficient filtering inside the knn query.
+    Other engines do not support it, see `filtered_knn_mode` for how they
+    are filtered. `field` is the vector field of the embedding model, see
+    embedding_models.
+    """
+    if not filter_clauses:
+        return {"knn": {field: {"vector": query_embedding, "k": top_k}}}
+
+    profile = get_index_profile(index_profile)
+    if profile["engine"] in ("lucene", "faiss"):
+        return {
+            "knn": {
+                field: {
+                    "vector": query_embedding,
+                    "k": top_k,
+                    "filter": {"bool": {"filter": filter_clauses}},
+                }
+            }
+        }
+    if filtered_knn_mode != "exact":
+        k = max(top_k, filtered_knn_candidates)
+        return {
+            "bool": {
+                "must": [{"knn": {field: {"vector": query_embedding, "k": k}}}],
+                "filter": filter_clauses,
+            }
+        }
+    return {
+        "script_score": {
+            "query": {"bool": {"filter": filter_clauses}},
+            "script": {
+                "source": "knn_score",
+                "lang": "knn",
+                "params": {
+                    "field": field,
+                    "query_value": query_embedding,
+                    "space_type": profile["space_type"],
+                },
+            },
+        }
+    }
+
+
+def build_keyword_query(
+    query_text, top_k=20, filters=None, source_fields=None, highlight=False
+):
+    """Build the request body of a keyword search."""
+    filter_clauses = build_filter_clauses(filters)
+    query = {"match": {"content": query_text}}
+    if filter_clauses:
+        query = {"bool": {"must": [query], "filter": filter_clauses}}
+    body = {
+        "size": top_k,
+        "query": query,
+        "_source": source_fields or SOURCE_FIELDS,
+    }
+    if highlight:
+        body["highlight"] = build_highlight()
+    return body
+
+
+def build_semantic_query(
+    query_embedding,
+    top_k=20,
+    filters=None,
+    index_profile=None,
+    source_fields=None,
+    field="embedding",
+):
+    """Build the request body of a k-NN search for an encoded query vector."""
+    filter_clauses = build_filter_clauses(filters)
+    return {
+        "size": top_k,
+        "query": build_knn_clause(query_embedding, top_k, filter_clauses, index_profile, field),
+        "_source": source_fields or SOURCE_FIELDS,
+    }
+
+
+def build_hybrid_query(
+    query_text,
+    query_embedding,
+    top_k=20,
+    filters=None,
+    index_profile=None,
+    source_fields=None,
+    highlight=False,
+    field="embedding",
+):
+    """Build the request body combining k-NN and keyword matching."""
+    filter_clauses = build_filter_clauses(filters)
+    query = {
+        "bool": {
+            "should": [
+                build_knn_clause(query_embedding, top_k, filter_clauses, index_profile, field),
+                {"match": {"content": query_text}},
+            ],
+            # Without it the filter alone would match, padding results with score 0
+            "minimum_should_match": 1,
+        }
+    }
+    if filter_clauses:
+        query["bool"]["filter"] = filter_clauses
+    body = {
+        "size": top_k,
+        "query": query,
+        "_source": source_fields or SOURCE_FIELDS,
+    }
+    if highlight:
+        # Highlights come from the keyword part of the query
+        body["highlight"] = build_highlight()
+    return body
+
+
+def keyword_search(query_text, top_k=20, filters=None, source_fields=None, highlight=False):
     """
     Perform keyword search using OpenSearch.
 
     Args:
         query_text (str): The query text to search for
         top_k (int): Number of results to return
+        filters (dict): Metadata filters, see build_filter_clauses
+        source_fields (list): Fields to return, e.g. CITATION_SOURCE_FIELDS
+        highlight (bool): Return matching `content` fragments in `highlight`
 
     Returns:
         list: Search results
@@ -17,101 +224,137 @@ def keyword_search(query_text, top_k=20):
 
     try:
         # Create a keyword search query
-        search_query = {
-            "size": top_k,
-            "query": {"match": {"content": query_text}},
-            "_source": ["content", "content_type", "token_count"],
-        }
+        search_query = build_keyword_query(
+            query_text, top_k, filters, source_fields, highlight
+        )
 
-        response = client.search(index=index_name, body=search_query)
+        with span("search", search_type="keyword", top_k=top_k):
+            response = client.search(index=index_name, body=search_query)
         return response["hits"]["hits"]
     except Exception as e:
         print(f"Keyword search error: {e}")
         return []
 
 
-def semantic_search(query_text, top_k=20):
+def semantic_search(
+    query_text,
+    top_k=20,
+    index_profile=None,
+    filters=None,
+    source_fields=None,
+    embedding_model=None,
+):
     """
     Perform semantic search using vector embeddings.
 
     Args:
         query_text (str): The query text to search for
         top_k (int): Number of results to return
+        index_profile (str): k-NN profile the index was built with,
+            LOCALRAG_INDEX_PROFILE by default
+        filters (dict): Metadata filters, see build_filter_clauses
+        source_fields (list): Fields to return, e.g. CITATION_SOURCE_FIELDS
+        embedding_model (str): Embedding model to search with, the active
+            model by default, which also triggers the shadow comparison
 
     Returns:
         list: Search results
     """
     client = get_opensearch_client("localhost", 9200)
     index_name = "localrag"
+    model = embedding_model or embedding_models.active_embedding_model
 
     try:
-        # Get embedding for the query
-        query_embedding = get_embedding(query_text)
+        started = time.perf_counter()
+        # Get embedding for the query, encoded like the indexed vectors
+        with span("query_embed", model=model):
+            query_embedding = encode_vector(get_embedding(query_text, model), index_profile)
 
         # Create a semantic search query
-        search_query = {
-            "size": top_k,
-            "query": {
-                "knn": {
-                    "embedding": {
-                        "vector": query_embedding,
-                        "k": top_k,
-                    }
-                }
-            },
-            "_source": ["content", "content_type", "token_count"],
-        }
+        search_query = build_semantic_query(
+            query_embedding, top_k, filters, index_profile, source_fields,
+            embedding_field(model),
+        )
 
-        response = client.search(index=index_name, body=search_query)
-        return response["hits"]["hits"]
+        with span("search", search_type="semantic", top_k=top_k):
+            response = client.search(index=index_name, body=search_query)
+        hits = response["hits"]["hits"]
+
+        if embedding_model is None:
+            run_shadow_search(
+                "semantic", query_text, hits, (time.perf_counter() - started) * 1000,
+                lambda shadow_model: semantic_search(
+                    query_text, top_k, index_profile, filters, source_fields, shadow_model
+                ),
+            )
+        return hits
     except Exception as e:
         print(f"Semantic search error: {e}")
         return []
 
 
-def hybrid_search(query_text, top_k=20):
+def hybrid_search(
+    query_text,
+    top_k=20,
+    index_profile=None,
+    filters=None,
+    source_fields=None,
+    highlight=False,
+    embedding_model=None,
+):
     """
     Perform hybrid search using both keyword and semantic search.
 
     Args:
         query_text (str): The query text to search for
         top_k (int): Number of results to return
+        index_profile (str): k-NN profile the index was built with,
+            LOCALRAG_INDEX_PROFILE by default
+        filters (dict): Metadata filters, see build_filter_clauses
+        source_fields (list): Fields to return, e.g. CITATION_SOURCE_FIELDS
+        highlight (bool): Return matching `content` fragments in `highlight`
+        embedding_model (str): Embedding model to search with, the active
+            model by default, which also triggers the shadow comparison
 
     Returns:
         list: Search results
     """
     client = get_opensearch_client("localhost", 9200)
     index_name = "localrag"
+    model = embedding_model or embedding_models.active_embedding_model
 
     try:
-        # Get embedding for the query
-        query_embedding = get_embedding(query_text)
+        started = time.perf_counter()
+        # Get embedding for the query, encoded like the indexed vectors
+        with span("query_embed", model=model):
+            query_embedding = encode_vector(get_embedding(query_text, model), index_profile)
 
         # Create a hybrid search query
-        search_query = {
-            "size": top_k,
-            "query": {
-                "bool": {
-                    "should": [
-                        {"knn": {"embedding": {"vector": query_embedding, "k": top_k}}},
-                        {"match": {"content": query_text}},
-                    ]
-                }
-            },
-            "_source": ["content", "content_type", "token_count"],
-        }
+        search_query = build_hybrid_query(
+            query_text, query_embedding, top_k, filters, index_profile,
+            source_fields, highlight, embedding_field(model),
+        )
 
-        response = client.search(index=index_name, body=search_query)
-        return response["hits"]["hits"]
+        with span("search", search_type="hybrid", top_k=top_k):
+            response = client.search(index=index_name, body=search_query)
+        hits = response["hits"]["hits"]
+
+        if embedding_model is None:
+            run_shadow_search(
+                "hybrid", query_text, hits, (time.perf_counter() - started) * 1000,
+                lambda shadow_model: hybrid_search(
+                    query_text, top_k, index_profile, filters, source_fields, highlight,
+                    shadow_model,
+                ),
+            )
+        return hits
     except Exception as e:
         print(f"Hybrid search error: {e}")
         # Fall back to keyword search
         try:
-            fallback_query = {
-                "size": top_k,
-                "query": {"match": {"content": query_text}},
-                "_source": ["content", "content_type", "token_count"],
-            }
+            fallback_query = build_keyword_query(
+                query_text, top_k, filters, source_fields, highlight
+            )
             response = client.search(index=index_name, body=fallback_query)
             return response["hits"]["hits"]
         except Exception as e2:
@@ -119,6 +362,153 @@ def hybrid_search(query_text, top_k=20):
             return []
 
 
+def batch_search(
+    queries,
+    search_type="hybrid",
+    top_k=20,
+    index_profile=None,
+    batch_size=200,
+    filters=None,
+    source_fields=None,
+):
+    """
+    Run many searches with one embedding call and one _msearch per batch.
+
+    Args:
+        queries (list): Query texts
+        search_type (str): Type of search (keyword, semantic, hybrid)
+        top_k (int): Number of results per query
+        index_profile (str): k-NN profile the index was built with,
+            LOCALRAG_INDEX_PROFILE by default
+        batch_size (int): Maximum number of queries per request
+        filters (dict): Metadata filters applied to every query
+        source_fields (list): Fields to return, e.g. CITATION_SOURCE_FIELDS
+
+    Returns:
+        list: One list of hits per query, in input order
+    """
+    client = get_opensearch_client("localhost", 9200)
+    index_name = "localrag"
+    model = embedding_models.active_embedding_model
+    field = embedding_field(model)
+
+    all_results = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start : start + batch_size]
+        try:
+            if search_type == "keyword":
+                bodies = [
+                    build_keyword_query(q, top_k, filters, source_fields) for q in batch
+                ]
+            else:
+                with span("query_embed", queries=len(batch), model=model):
+                    embeddings = [
+                        encode_vector(e, index_profile) for e in get_embeddings(batch, model)
+                    ]
+                if search_type == "semantic":
+                    bodies = [
+                        build_semantic_query(
+                            e, top_k, filters, index_profile, source_fields, field
+                        )
+                        for e in embeddings
+                    ]
+                else:  # hybrid
+                    bodies = [
+                        build_hybrid_query(
+                            q, e, top_k, filters, index_profile, source_fields, False, field
+                        )
+                        for q, e in zip(batch, embeddings)
+                    ]
+
+            # _msearch takes alternating header and body lines
+            lines = []
+            for body in bodies:
+                lines.append({"index": index_name})
+                lines.append(body)
+            with span("search", search_type=search_type, top_k=top_k, queries=len(batch)):
+                response = client.msearch(body=lines)
+
+            for query, item in zip(batch, response["responses"]):
+                if "error" in item:
+                    print(f"Batch search error for '{query}': {item['error']}")
+                    all_results.append([])
+                else:
+                    all_results.append(item["hits"]["hits"])
+        except Exception as e:
+            print(f"Batch search error: {e}")
+            all_results.extend([] for _ in batch)
+
+    return all_results
+
+
+def expand_hits(hits, mode="parent", index_name="localrag"):
+    """
+    Expand matched child chunks to more context with a single multi-get.
+
+    Args:
+        hits (list): Search hits, best first
+        mode (str): "parent" replaces children with their parent section,
+            "neighbors" adds the previous and next child around each match
+        index_name (str): Name of the child index
+
+    Returns:
+        list: Hits in the original order with expanded content, where hits
+            whose context is already covered by a better hit are dropped
+    """
+    if mode == "parent":
+        wanted = [hit["_source"].get("parent_id") for hit in hits]
+        target_index = f"{index_name}_parents"
+    else:  # neighbors
+        wanted = [
+            neighbor
+            for hit in hits
+            for neighbor in (hit["_source"].get("prev_id"), hit["_source"].get("next_id"))
+        ]
+        target_index = index_name
+    wanted = list(dict.fromkeys(doc_id for doc_id in wanted if doc_id))
+    if not wanted:
+        return hits
+
+    client = get_opensearch_client("localhost", 9200)
+    try:
+        with span("expand", mode=mode, documents=len(wanted)):
+            response = client.mget(
+                index=target_index, body={"ids": wanted}, _source=["content"]
+            )
+    except Exception as e:
+        print(f"Context expansion error: {e}")
+        return hits
+    contents = {
+        doc["_id"]: doc["_source"]["content"] for doc in response["docs"] if doc.get("found")
+    }
+
+    expanded, covered = [], set()
+    for hit in hits:
+        source = hit["_source"]
+        if mode == "parent":
+            parent_id = source.get("parent_id")
+            if parent_id in covered:
+                continue
+            if parent_id in contents:
+                covered.add(parent_id)
+                hit = {**hit, "_source": {**source, "content": contents[parent_id]}}
+        else:
+            chunk_id = source.get("chunk_id")
+            if chunk_id and chunk_id in covered:
+                continue
+            parts = [source.get("content", "")]
+            if contents.get(source.get("prev_id")) and source.get("prev_id") not in covered:
+                parts.insert(0, contents[source["prev_id"]])
+                covered.add(source["prev_id"])
+            if contents.get(source.get("next_id")) and source.get("next_id") not in covered:
+                parts.append(contents[source["next_id"]])
+                covered.add(source["next_id"])
+            covered.add(chunk_id)
+            hit = {**hit, "_source": {**source, "content": " ".join(parts)}}
+        expanded.append(hit)
+    return expanded
+
+
 if __name__ == "__main__":
     from pprint import pprint
 
@@ -126,4 +516,4 @@ if __name__ == "__main__":
     # results = keyword_search(query, top_k=10)
     # results = semantic_search(query, top_k=10)
     results = hybrid_search(query, top_k=10)
-    pprint(results)
\ No newline at end of file
+    pprint(results)
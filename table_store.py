@@ -0,0 +1,451 @@
+import json
+import os
+import re
+from collections import defaultdict
+from html.parser import HTMLParser
+
+from tracing import incr, span
+
+json_output_table_chunks_path = "table_chunks.json"
+json_output_table_store_path = "table_store.json"
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for",
+    "from", "how", "in", "is", "it", "its", "much", "of", "on", "or", "the", "to",
+    "was", "were", "what", "which", "who", "with", "accenture", "fiscal", "year",
+    "tell", "me", "total",
+}
+
+# Questions asking for a figure: "how much/many ..." or "what was the <figure> ...".
+# Only these are grounded with table facts, a direct answer also needs a year
+# (see answer_from_tables), and questions about reasons or plans never qualify.
+NUMERIC_QUESTION_PATTERN = re.compile(r"^\s*(how much|how many)\b", re.IGNORECASE)
+FIGURE_QUESTION_PATTERN = re.compile(
+    r"^\s*what (is|was|were|are)\b.*\b(revenues?|income|earnings|margins?|cash|bookings|"
+    r"dividends?|per share|eps|costs?|expenses?|assets|liabilities|debt|tax(es)?|profit|"
+    r"amount|value|number|rate|headcount)\b",
+    re.IGNORECASE,
+)
+NON_NUMERIC_PATTERN = re.compile(
+    r"\b(why|doing|risks?|reduce|plan|plans|strategy|explain|describe|impact|affect)\b",
+    re.IGNORECASE,
+)
+QUESTION_YEAR_PATTERN = re.compile(r"\b(?:FY ?)?((?:19|20)\d{2})\b", re.IGNORECASE)
+YEAR_PATTERN = re.compile(r"^(?:FY)?((?:19|20)\d{2})$")
+# Statement headers such as "(In thousands of U.S. dollars, except share ...)"
+SCALE_PATTERN = re.compile(
+    r"\bin (thousands|millions|billions)\b( of (u\.s\. )?dollars)?", re.IGNORECASE
+)
+NUMBER_PATTERN = re.compile(r"^\(?-?\$?\s*\(?([\d,]*\.?\d+)\)?\s*\$?\s*(%)?\)?\s*(%)?;?$")
+
+# Share of a row label's tokens the question must contain for the row to be
+# used, more than half so "operating margin" does not match "Operating activities"
+min_fact_score = 0.6
+
+_table_store = None
+
+
+class _TableHTMLParser(HTMLParser):
+    """Collect the cell texts of each row, repeating cells with colspan."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._row = None
+        self._cell = None
+        self._colspan = 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+            self._colspan = int(dict(attrs).get("colspan", 1) or 1)
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            text = " ".join("".join(self._cell).split())
+            self._row.extend([text] * self._colspan)
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_number(text):
+    """
+    Parse a financial cell such as "$ 7,003,530", "(47,525)" or "(4)%".
+
+    Returns:
+        tuple: (value, unit) or (None, None) if the cell is not numeric
+    """
+    text = text.strip()
+    match = NUMBER_PATTERN.match(text)
+    if not match:
+        return None, None
+    value = float(match.group(1).replace(",", ""))
+    if "(" in text or text.startswith("-"):
+        value = -value
+    unit = "%" if "%" in text else "$" if "$" in text else None
+    return value, unit
+
+
+def _is_year_row(cells):
+    years = [c for c in cells if YEAR_PATTERN.match(c)]
+    others = [c for c in cells if c and not YEAR_PATTERN.match(c) and parse_number(c)[0] is not None]
+    return len(years) >= 2 and not others
+
+
+def _scale_of(texts):
+    """
+    Find the scale and currency stated in the first text that has one.
+
+    Returns:
+        tuple: (scale such as "thousands" or None, "$" or None)
+    """
+    for text in texts:
+        match = SCALE_PATTERN.search(text or "")
+        if match:
+            return match.group(1).lower(), "$" if match.group(2) else None
+    return None, None
+
+
+def parse_table(html):
+    """
+    Parse table HTML into a compact columnar table.
+
+    Returns:
+        dict: columns (header labels), row_labels, units per row and values
+            stored column-wise (values[column][row])
+    """
+    parser = _TableHTMLParser()
+    parser.feed(html or "")
+
+    columns = []
+    row_labels, units, rows = [], [], []
+    for cells in parser.rows:
+        if _is_year_row(cells):
+            columns = [YEAR_PATTERN.match(c).group(1) for c in cells if YEAR_PATTERN.match(c)]
+            continue
+
+        label_parts, values, row_unit = [], [], None
+        for cell in cells:
+            if cell == "$":
+                # Statements put the currency sign in its own column
+                row_unit = row_unit or "$"
+                continue
+            if not cell:
+                continue
+            if cell in ("_", "—", "-"):
+                values.append(None)
+                continue
+            value, unit = parse_number(cell)
+            if value is None:
+                # Labels come before the numbers of a row
+                if not values:
+                    label_parts.append(cell)
+            else:
+                values.append(value)
+                row_unit = row_unit or unit
+
+        label = " ".join(dict.fromkeys(label_parts))
+        if label and any(v is not None for v in values):
+            row_labels.append(label)
+            units.append(row_unit)
+            rows.append(values)
+
+    width = max((len(r) for r in rows), default=0)
+    if len(columns) != width:
+        columns = columns[:width] + [f"column {i + 1}" for i in range(len(columns), width)]
+
+    scale, currency = _scale_of(" ".join(row) for row in parser.rows[:2])
+    return {
+        "columns": columns,
+        "row_labels": row_labels,
+        "units": units,
+        "scale": scale,
+        "currency": currency,
+        "values": [[r[c] if c < len(r) else None for r in rows] for c in range(width)],
+    }
+
+
+def _tokenize(text):
+    # Numbers and years are not labels ("May 15, 2023"), years select columns.
+    # A trailing "s" is dropped so "revenue" matches "Revenues".
+    return [
+        t[:-1] if len(t) > 3 and t.endswith("s") else t
+        for t in re.findall(r"[a-z0-9]+", text.lower())
+        if t not in STOPWORDS and not t.isdigit()
+    ]
+
+
+def _page_texts(text_chunks):
+    """Join the text chunks of each (file, page)."""
+    pages = defaultdict(list)
+    for chunk in text_chunks or []:
+        if chunk.get("page_number"):
+            filename = chunk.get("filename") or chunk.get("file_name", "")
+            pages[(filename, int(chunk["page_number"]))].append(chunk.get("content", ""))
+    return {key: " ".join(texts) for key, texts in pages.items()}
+
+
+def build_table_store(table_chunks, text_chunks=None, fiscal_year=None):
+    """
+    Build the columnar table store and its row label index from table chunks.
+
+    Financial statements state their scale ("In thousands of U.S. dollars")
+    in a page header rather than in the table, so the text chunks of the
+    same page are searched when the table itself does not say.
+
+    Args:
+        table_chunks: Processed table chunks with `table_as_html`
+        text_chunks: Text chunks with page numbers, for page headers
+        fiscal_year: Fiscal year of the report, inferred from the filename
+            when not given
+
+    Returns:
+        dict: {"tables": [...], "index": {token: [[table, row], ...]}}
+    """
+    from ingestion import infer_fiscal_year
+
+    page_texts = _page_texts(text_chunks)
+    tables = []
+    index = defaultdict(list)
+    for chunk in table_chunks:
+        table = parse_table(chunk.get("table_as_html", ""))
+        if not table["row_labels"]:
+            continue
+        table["table_id"] = len(tables)
+        table["file_name"] = chunk.get("file_name") or chunk.get("filename", "")
+        table["page_number"] = int(chunk["page_number"]) if chunk.get("page_number") else None
+        table["fiscal_year"] = fiscal_year or infer_fiscal_year(table["file_name"])
+        if table["scale"] is None:
+            table["scale"], table["currency"] = _scale_of(
+                [chunk.get("table_text", ""), page_texts.get((table["file_name"], table["page_number"]))]
+            )
+        for row, label in enumerate(table["row_labels"]):
+            for token in set(_tokenize(label)):
+                index[token].append([table["table_id"], row])
+        tables.append(table)
+
+    unknown = sum(1 for table in tables if table["scale"] is None)
+    if unknown:
+        # Their amounts are left out of prompts and answers (see lookup_table_facts)
+        print(
+            f"[WARN] {unknown} of {len(tables)} tables have no known scale. Text chunks "
+            "with page numbers (chunking.create_semantic_chunks) provide page headers."
+        )
+    return {"tables": tables, "index": dict(index)}
+
+
+def save_table_store(store, json_path: str = json_output_table_store_path):
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False)
+    print(f"[INFO] Table store with {len(store['tables'])} tables saved to '{json_path}'.")
+
+
+def load_table_store(json_path: str = json_output_table_store_path):
+    """Load the table store once, returning None if it was never built."""
+    global _table_store
+    if _table_store is None and os.path.exists(json_path):
+        with open(json_path, "r", encoding="utf-8") as f:
+            _table_store = json.load(f)
+    return _table_store
+
+
+def _matches_filters(table, filters):
+    """Apply the retrieval filters (see retrieval.build_filter_clauses) to a table."""
+    if not filters:
+        return True
+    if filters.get("content_types") and "table" not in filters["content_types"]:
+        return False
+    if filters.get("filenames") and table["file_name"] not in filters["filenames"]:
+        return False
+    if filters.get("page_range"):
+        first, last = filters["page_range"]
+        page = table["page_number"]
+        if page is None or (first is not None and page < int(first)) or (
+            last is not None and page > int(last)
+        ):
+            return False
+    if filters.get("fiscal_year"):
+        years = filters["fiscal_year"]
+        years = years if isinstance(years, (list, tuple)) else [years]
+        if table.get("fiscal_year") not in [int(y) for y in years]:
+            return False
+    return True
+
+
+def lookup_table_facts(question, store=None, max_facts=5, filters=None):
+    """
+    Find table cells whose row labels match the question.
+
+    A row's score is the share of its label tokens found in the question,
+    rows below `min_fact_score` are dropped. If the question names a year
+    that is a column header, that column is used, otherwise the first (most
+    recent) column. Amounts of tables whose scale ("in thousands") is
+    unknown are left out, they could be off by a factor of 1000.
+
+    Args:
+        question: User question
+        store: Table store, loaded from disk by default
+        max_facts: Number of facts to return
+        filters: Retrieval filters, tables outside them are ignored
+
+    Returns:
+        list: Facts sorted by score, best first
+    """
+    store = store or load_table_store()
+    if not store:
+        return []
+
+    question_tokens = set(_tokenize(question))
+    years = set(QUESTION_YEAR_PATTERN.findall(question))
+
+    with span("table_lookup") as s:
+        matched = defaultdict(int)
+        for token in question_tokens:
+            for table_id, row in store["index"].get(token, []):
+                matched[(table_id, row)] += 1
+
+        facts, seen = [], set()
+        for (table_id, row), count in matched.items():
+            table = store["tables"][table_id]
+            if not _matches_filters(table, filters):
+                continue
+            label = table["row_labels"][row]
+            score = count / len(set(_tokenize(label)))
+            unit = _unit_of(table, row)
+            if score < min_fact_score or (table["scale"] is None and unit != "%"):
+                continue
+            columns = [c for c, name in enumerate(table["columns"]) if name in years] or [0]
+            for column in columns:
+                value = table["values"][column][row]
+                # Repeated rows of a table (e.g. per section) are listed once
+                key = (table_id, label, table["columns"][column], value)
+                if value is None or key in seen:
+                    continue
+                seen.add(key)
+                facts.append(
+                    {
+                        "label": label,
+                        "column": table["columns"][column],
+                        "value": value,
+                        "unit": unit,
+                        "scale": table["scale"],
+                        "table_id": table_id,
+                        "page_number": table["page_number"],
+                        "file_name": table["file_name"],
+                        "score": score,
+                    }
+                )
+        # Prefer full label matches, tables with year headers, then shorter
+        # (more specific) labels
+        facts.sort(
+            key=lambda f: (-f["score"], f["column"].startswith("column "), len(f["label"]))
+        )
+        s.set("facts", len(facts))
+    return facts[:max_facts]
+
+
+def _unit_of(table, row):
+    """Row unit, or the table's currency except for share counts and per share amounts."""
+    unit = table["units"][row]
+    if unit is None and table.get("currency") and "share" not in table["row_labels"][row].lower():
+        return table["currency"]
+    return unit
+
+
+def format_fact(fact):
+    """Render a fact as one line with its source."""
+    value = fact["value"]
+    number = f"{value:,.0f}" if value == int(value) else f"{value:,.2f}"
+    if fact["unit"] == "$":
+        number = f"${number}"
+    elif fact["unit"] == "%":
+        number = f"{number}%"
+    if fact["scale"]:
+        number = f"{number} (in {fact['scale']})"
+    column = f" [{fact['column']}]" if not fact["column"].startswith("column ") else ""
+    return (
+        f"{fact['label']}{column}: {number} "
+        f"(table on page {fact['page_number']} of {fact['file_name']})"
+    )
+
+
+def is_numeric_question(question):
+    """A question asking for a figure, not for reasons or plans."""
+    return bool(
+        NUMERIC_QUESTION_PATTERN.search(question) or FIGURE_QUESTION_PATTERN.search(question)
+    ) and not NON_NUMERIC_PATTERN.search(question)
+
+
+def answer_from_tables(question, store=None, filters=None):
+    """
+    Answer a numeric question directly from the table store when confident.
+
+    Other questions get no facts, so table rows do not crowd their prompts.
+
+    Args:
+        question: User question
+        store: Table store, loaded from disk by default
+        filters: Retrieval filters applied to the tables
+
+    Returns:
+        tuple: (answer or None, facts) - facts can ground the RAG prompt
+            when no direct answer is given
+    """
+    if not is_numeric_question(question):
+        return None, []
+    facts = lookup_table_facts(question, store, filters=filters)
+    years = set(QUESTION_YEAR_PATTERN.findall(question))
+    if not facts or not years:
+        return None, facts
+
+    best = facts[0]
+    # Only answer directly when the whole row label appears in the question,
+    # the column is the year asked for, the scale is known and no other row
+    # matches equally well with another label or another value
+    best_tokens = set(_tokenize(best["label"]))
+    ties = [
+        f for f in facts
+        if f["score"] == best["score"]
+        and (set(_tokenize(f["label"])) != best_tokens or f["value"] != best["value"])
+    ]
+    if (
+        best["score"] < 1.0
+        or best["column"] not in years
+        or (best["scale"] is None and best["unit"] != "%")
+        or ties
+    ):
+        return None, facts
+
+    incr("table_fast_path_hit")
+    return format_fact(best), facts
+
+
+if __name__ == "__main__":
+    from helper import load_chunks_from_cache_file
+    from ingestion import json_output_text_chunks_path
+
+    table_chunks = load_chunks_from_cache_file(json_output_table_chunks_path)
+    text_chunks = load_chunks_from_cache_file(json_output_text_chunks_path)
+    store = build_table_store(table_chunks, text_chunks, fiscal_year=2023)
+    save_table_store(store)
+
+    for question in [
+        "What is the net income of Accenture?",
+        "What were the revenues in 2022?",
+        "How much were total new bookings in fiscal 2023?",
+        "What are the risks to revenues?",
+        "Who is the chief executive officer?",
+    ]:
+        answer, facts = answer_from_tables(question, store)
+        print(question)
+        print(f"  answer: {answer}")
+        for fact in facts:
+            print(f"  fact: {format_fact(fact)}")
@@ -0,0 +1,319 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+# Tracing is configured from the environment, e.g.
+#   LOCALRAG_TRACING=json,prometheus
+# Available exporters: json (JSON lines log), prometheus (text endpoint),
+# otel (forwards spans to the OpenTelemetry SDK if it is installed).
+# When no exporter is configured, span() returns a shared no-op object.
+# The Prometheus endpoint is only opened by the servers (api.py, frontend.py)
+# through serve_metrics(), not by every process importing this module.
+trace_log_path = os.getenv("LOCALRAG_TRACE_LOG", "traces.jsonl")
+metrics_port = int(os.getenv("LOCALRAG_METRICS_PORT", "9464"))
+
+_enabled = False
+_exporters = []
+_current_span = contextvars.ContextVar("localrag_current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled, every method does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+    def mark(self, event):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """Timing span for one pipeline stage."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.events = {}
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        for exporter in _exporters:
+            # Exporters that need the parent before the child ends (otel)
+            if hasattr(exporter, "start_span"):
+                try:
+                    exporter.start_span(self)
+                except Exception as e:
+                    print(f"Tracing exporter error: {e}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Streaming generators may be resumed from another context
+            pass
+
+        record = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": duration_ms,
+            "attributes": self.attributes,
+            "events": self.events,
+            "error": repr(exc) if exc else None,
+        }
+        for exporter in _exporters:
+            try:
+                exporter.export_span(record)
+            except Exception as e:
+                print(f"Tracing exporter error: {e}")
+        return False
+
+    def set(self, key, value):
+        """Attach an attribute such as a token count to the span."""
+        self.attributes[key] = value
+
+    def mark(self, event):
+        """Record the offset of an event (e.g. first token) in milliseconds."""
+        self.events[event] = (time.perf_counter() - self._started) * 1000
+
+
+def span(name, **attributes):
+    """
+    Time a pipeline stage.
+
+    Usage:
+        with span("search", search_type="hybrid") as s:
+            ...
+            s.set("hits", len(hits))
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def incr(name, value=1):
+    """Increment a counter such as a cache hit or miss."""
+    if not _enabled:
+        return
+    for exporter in _exporters:
+        exporter.export_counter(name, value)
+
+
+class JsonLogExporter:
+    """Append spans and counter increments as JSON lines."""
+
+    def __init__(self, path=trace_log_path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def export_span(self, record):
+        self._write({"type": "span", **record})
+
+    def export_counter(self, name, value):
+        self._write({"type": "counter", "name": name, "value": value, "time": time.time()})
+
+
+class PrometheusExporter:
+    """Aggregate spans into per-stage summaries exposed in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: [0, 0.0])
+        self._events = defaultdict(lambda: [0, 0.0])
+        self._counters = defaultdict(float)
+
+    def export_span(self, record):
+        with self._lock:
+            stats = self._durations[record["name"]]
+            stats[0] += 1
+            stats[1] += record["duration_ms"] / 1000
+            for event, offset_ms in record["events"].items():
+                stats = self._events[(record["name"], event)]
+                stats[0] += 1
+                stats[1] += offset_ms / 1000
+            for key, value in record["attributes"].items():
+                if key.endswith("_tokens") and isinstance(value, (int, float)):
+                    self._counters[f"{record['name']}_{key}"] += value
+
+    def export_counter(self, name, value):
+        with self._lock:
+            self._counters[name] += value
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE localrag_stage_duration_seconds summary",
+        ]
+        with self._lock:
+            for name, (count, total) in sorted(self._durations.items()):
+                lines.append(f'localrag_stage_duration_seconds_count{{stage="{name}"}} {count}')
+                lines.append(f'localrag_stage_duration_seconds_sum{{stage="{name}"}} {total}')
+            lines.append("# TYPE localrag_stage_event_seconds summary")
+            for (name, event), (count, total) in sorted(self._events.items()):
+                labels = f'stage="{name}",event="{event}"'
+                lines.append(f"localrag_stage_event_seconds_count{{{labels}}} {count}")
+                lines.append(f"localrag_stage_event_seconds_sum{{{labels}}} {total}")
+            for name, value in sorted(self._counters.items()):
+                # Counter names may embed labels such as backend names
+                name = re.sub(r"[^a-zA-Z0-9_]", "_", name)
+                lines.append(f"# TYPE localrag_{name}_total counter")
+                lines.append(f"localrag_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=metrics_port):
+        """Serve /metrics from a background thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        except OSError as e:
+            print(f"[WARN] Cannot serve Prometheus metrics on port {port}: {e}")
+            return None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"[INFO] Serving Prometheus metrics on port {port}")
+        return server
+
+
+class OpenTelemetryExporter:
+    """
+    Forward spans and counters to the OpenTelemetry SDK.
+
+    OpenTelemetry spans are started when the local span starts, so that
+    children (which end first) can be parented to them and the trace
+    keeps its shape.
+    """
+
+    def __init__(self):
+        from opentelemetry import metrics, trace
+
+        self._trace = trace
+        self._tracer = trace.get_tracer("localrag")
+        self._meter = metrics.get_meter("localrag")
+        self._counters = {}
+        # span_id -> open OpenTelemetry span
+        self._open = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _attributes(attributes):
+        # OpenTelemetry rejects None attribute values
+        return {k: v for k, v in attributes.items() if v is not None}
+
+    def start_span(self, local_span):
+        with self._lock:
+            parent = self._open.get(local_span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self._tracer.start_span(
+            local_span.name,
+            context=context,
+            start_time=int(local_span.start_time * 1e9),
+            attributes=self._attributes(local_span.attributes),
+        )
+        with self._lock:
+            self._open[local_span.span_id] = otel_span
+        return otel_span
+
+    def export_span(self, record):
+        start_ns = int(record["start_time"] * 1e9)
+        with self._lock:
+            otel_span = self._open.pop(record["span_id"], None)
+        if otel_span is None:
+            # Started before this exporter was enabled
+            otel_span = self._tracer.start_span(record["name"], start_time=start_ns)
+        otel_span.set_attributes(self._attributes(record["attributes"]))
+        for event, offset_ms in record["events"].items():
+            otel_span.add_event(event, timestamp=start_ns + int(offset_ms * 1e6))
+        otel_span.end(end_time=start_ns + int(record["duration_ms"] * 1e6))
+
+    def export_counter(self, name, value):
+        if name not in self._counters:
+            self._counters[name] = self._meter.create_counter(f"localrag.{name}")
+        self._counters[name].add(value)
+
+
+def enable(*exporters):
+    """Turn tracing on with the given exporter instances."""
+    global _enabled
+    _exporters.extend(exporters)
+    _enabled = bool(_exporters)
+
+
+def disable():
+    """Turn tracing off and drop all exporters."""
+    global _enabled
+    _enabled = False
+    _exporters.clear()
+
+
+def configure_from_env():
+    """Enable the exporters listed in LOCALRAG_TRACING."""
+    names = [n.strip() for n in os.getenv("LOCALRAG_TRACING", "").split(",") if n.strip()]
+    exporters = []
+    for name in names:
+        if name == "json":
+            exporters.append(JsonLogExporter())
+        elif name == "prometheus":
+            exporters.append(PrometheusExporter())
+        elif name == "otel":
+            try:
+                exporters.append(OpenTelemetryExporter())
+            except ImportError:
+                print("[WARN] opentelemetry is not installed, skipping otel exporter")
+        else:
+            print(f"[WARN] Unknown tracing exporter '{name}'")
+    if exporters:
+        enable(*exporters)
+
+
+def serve_metrics(port=metrics_port):
+    """Serve /metrics for the configured Prometheus exporter, if any."""
+    for exporter in _exporters:
+        if isinstance(exporter, PrometheusExporter):
+            return exporter.serve(port)
+    return None
+
+
+configure_from_env()